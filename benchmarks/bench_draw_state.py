@@ -0,0 +1,131 @@
+"""
+Benchmark the in-place evaluation of candidate groups (group stage DrawEngine) against the previous
+evaluation rebuilding the remaining groups, the TV counters and the matching graph for every candidate.
+Times are measured in a plain run and memory in a second run: the peak of allocated memory with tracemalloc
+when available (Python 3), otherwise the growth of the peak resident set size of a forked process.
+Usage: python benchmarks/bench_draw_state.py [number of simulated draws]
+"""
+from __future__ import print_function
+import gc
+import os
+import sys
+import time
+import numpy as np
+from configurations import champions_league_2018_group_stage, europa_league_2018_group_stage
+import group_stage_simulator
+from constraints import GroupStageConstraints
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def simulate_draw_without_state(simulations, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                                paired_clubs, groups_in_first_timetable, groups_in_second_timetable, random_state):
+    """
+    Simulation of the draw as implemented before the in-place evaluation: every candidate group is checked
+    from scratch.
+    """
+    constraints = GroupStageConstraints(associations, paired_clubs, clubs_per_pot,
+                                        groups_in_first_timetable, groups_in_second_timetable)
+    draws = np.full((simulations, clubs_per_pot, number_of_pots), -1, dtype=int)
+    simulation = 0
+    while simulation < simulations:
+        feasible = True
+        draw = draws[simulation]
+        draw[:] = -1
+        club_groups = np.full(len(clubs), -1, dtype=int)
+        for pot_idx in range(number_of_pots):
+            clubs_in_pot = [idx for idx, pot in enumerate(club_pots) if pot == pot_idx+1]
+            groups_available = list(range(clubs_per_pot))
+            while len(clubs_in_pot) > 0:
+                drawn_club = random_state.choice(clubs_in_pot)
+                clubs_in_pot.remove(drawn_club)
+                feasible_groups = group_stage_simulator.get_feasible_groups(
+                    draw, drawn_club, clubs_in_pot, groups_available, pot_idx, associations, paired_clubs,
+                    groups_in_first_timetable, groups_in_second_timetable, constraints, club_groups)
+                if len(feasible_groups) == 0:
+                    feasible = False
+                    break
+                assigned_group = random_state.choice(feasible_groups)
+                groups_available.remove(assigned_group)
+                draw[assigned_group, pot_idx] = drawn_club
+                club_groups[drawn_club] = assigned_group
+            if not feasible:
+                break
+        if feasible and constraints.is_valid_draw(draw)[0]:
+            simulation += 1
+    return draws
+
+
+def measure(function, simulations, config):
+    """
+    Run a simulation measuring time, then run it again measuring memory (tracing allocations slows it down).
+    :return: a tuple (draws, seconds, peak memory in KiB or None)
+    """
+    start = time.time()
+    draws = function(simulations, config)
+    elapsed = time.time() - start
+    return draws, elapsed, measure_memory(function, simulations, config)
+
+
+def measure_memory(function, simulations, config):
+    """
+    Peak memory of a simulation: the tracemalloc peak of allocated memory when available (Python 3),
+    otherwise the growth of the peak resident set size of a forked process running it (Python 2 on Unix).
+    :return: peak memory in KiB or None if it cannot be measured
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            function(simulations, config)
+            return tracemalloc.get_traced_memory()[1] / 1024.0
+        finally:
+            tracemalloc.stop()
+    if resource is None or not hasattr(os, 'fork'):
+        return None
+    gc.collect()
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_end)
+            # The forked process starts with the resident set size of the parent
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            function(simulations, config)
+            os.write(write_end, str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline).encode())
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    output = os.read(read_end, 64)
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    return float(output) if output else None  # KiB on Linux
+
+
+def main():
+    simulations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for name, config in (("Champions League", champions_league_2018_group_stage()),
+                         ("Europa League", europa_league_2018_group_stage())):
+        before = measure(lambda n, c: simulate_draw_without_state(n, *c, random_state=np.random.RandomState(0)),
+                         simulations, config)
+        after = measure(lambda n, c: group_stage_simulator.simulate_draw(n, *c, show_errors=False,
+                                                                         random_state=np.random.RandomState(0)),
+                        simulations, config)
+        assert (before[0] == after[0]).all()
+        print("%s: %d simulated draws" % (name, simulations))
+        for label, (_, elapsed, peak) in (("from scratch", before), ("in place", after)):
+            memory = "" if peak is None else ", peak %.1f KiB" % peak
+            print("\t%-12s %.3fs (%.2f ms/draw%s)" % (label + ":", elapsed, 1e3 * elapsed / simulations, memory))
+    if tracemalloc is None:
+        print("tracemalloc is not available, peak memory is the growth of the peak resident set size"
+              if resource is not None and hasattr(os, 'fork') else "memory was not measured")
+
+
+if __name__ == '__main__':
+    main()
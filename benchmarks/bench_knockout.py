@@ -0,0 +1,54 @@
+"""
+Benchmark the batched knockout draw simulator against the loop used in the notebooks,
+comparing both estimates with the exact probabilities.
+Usage: python benchmarks/bench_knockout.py [number of simulated draws]
+"""
+from __future__ import print_function
+import sys
+import time
+import numpy as np
+from configurations import champions_league_2018_knockout_stage
+from knockout_stage_simulator import (filter_winners, remove_winners_leading_to_dead_ends,
+                                      calculate_knockout_probabilities, simulate_knockout_draws)
+
+
+def simulate_knockout_draws_in_loop(runners_up, winners, simulations):
+    """
+    Realistic Monte Carlo simulation of the knockout draw as implemented in the notebooks.
+    """
+    probabilities = np.full((len(winners), len(runners_up)), 0, dtype=np.float32)
+    for _ in range(simulations):
+        winners_pot = winners[:]
+        runners_up_pot = runners_up[:]
+        while len(runners_up_pot) > 0:
+            runner_up = np.random.choice(runners_up_pot)
+            eligible_winners = filter_winners(runner_up, winners_pot)
+            eligible_winners = remove_winners_leading_to_dead_ends(eligible_winners, winners_pot,
+                                                                   runner_up, runners_up_pot)
+            winner = np.random.choice(eligible_winners)
+            runners_up_pot.remove(runner_up)
+            winners_pot.remove(winner)
+            probabilities[winners.index(winner), runners_up.index(runner_up)] += 1
+    return probabilities / simulations
+
+
+def main():
+    simulations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    runners_up, winners = champions_league_2018_knockout_stage()
+    exact = calculate_knockout_probabilities(runners_up, winners)
+    np.random.seed(0)
+    start = time.time()
+    loop_probabilities = simulate_knockout_draws_in_loop(runners_up, winners, simulations)
+    loop_time = time.time() - start
+    start = time.time()
+    batched_probabilities = simulate_knockout_draws(runners_up, winners, simulations, np.random.RandomState(0))
+    batched_time = time.time() - start
+    print("Knockout stage: %d simulated draws" % simulations)
+    print("\tloop:    %.3fs (%.1f us/draw, max abs error %.4f)"
+          % (loop_time, 1e6 * loop_time / simulations, np.abs(loop_probabilities - exact).max()))
+    print("\tbatched: %.3fs (%.1f us/draw, max abs error %.4f)"
+          % (batched_time, 1e6 * batched_time / simulations, np.abs(batched_probabilities - exact).max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark the bitmask matching engine against the previous networkx implementation
+on the dead-end checks performed by the draw engine while simulating Champions League draws.
+Usage: python benchmarks/bench_matching.py [number of simulated draws]
+"""
+from __future__ import print_function
+import itertools
+import sys
+import time
+import networkx as nx
+import numpy as np
+from configurations import champions_league_2018_group_stage, champions_league_2018_knockout_stage
+import engine
+import group_stage_simulator
+import knockout_stage_simulator
+from matching import complete_matching, iterate_bits
+
+
+def networkx_complete_matching(adjacency):
+    """
+    Dead-end check as implemented before the bitmask matching engine, on the same bipartite graph.
+    :param adjacency: dictionary with clubs as keys and bitmasks of allowed groups as values
+    """
+    graph = nx.Graph()
+    size = len(adjacency)
+    graph.add_nodes_from(range(size), bipartite=0)
+    for idx, club in enumerate(adjacency):
+        for group in iterate_bits(adjacency[club]):
+            graph.add_edge(idx, size + group)
+    if size == 0:
+        return True
+    return len(nx.algorithms.bipartite.maximum_matching(graph)) == 2 * size
+
+
+def bitmask_complete_matching(adjacency):
+    """
+    Dead-end check of the bitmask matching engine, without reusing the matching of the previous check.
+    """
+    return complete_matching(adjacency)
+
+
+def record_group_stage_instances(simulations, config):
+    """
+    Simulate draws recording the bipartite graph (remaining clubs x available groups)
+    of every dead-end check of the draw engine.
+    """
+    instances = []
+
+    def recorder(adjacency, owners=None):
+        instances.append(dict(adjacency))
+        return complete_matching(adjacency, owners)
+
+    engine.complete_matching = recorder
+    try:
+        group_stage_simulator.simulate_draw(simulations, *config, show_errors=False,
+                                            random_state=np.random.RandomState(0))
+    finally:
+        engine.complete_matching = complete_matching
+    return instances
+
+
+def time_calls(function, instances):
+    start = time.time()
+    results = [function(*instance) for instance in instances]
+    return time.time() - start, results
+
+
+def compare(name, networkx_function, bitmask_function, instances):
+    """
+    Time both dead-end checks on the same instances and check that they agree.
+    """
+    if len(instances) == 0:
+        print("%s: no dead-end checks recorded" % name)
+        return
+    nx_time, nx_results = time_calls(networkx_function, instances)
+    bm_time, bm_results = time_calls(bitmask_function, instances)
+    assert nx_results == bm_results
+    print("%s: %d dead-end checks" % (name, len(instances)))
+    print("\tnetworkx: %.3fs (%.1f us/check)" % (nx_time, 1e6 * nx_time / len(instances)))
+    print("\tbitmask:  %.3fs (%.1f us/check)" % (bm_time, 1e6 * bm_time / len(instances)))
+
+
+def main():
+    simulations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    instances = [(adjacency,) for adjacency in
+                 record_group_stage_instances(simulations, champions_league_2018_group_stage())]
+    compare("Group stage", networkx_complete_matching, bitmask_complete_matching, instances)
+
+    runners_up, winners = champions_league_2018_knockout_stage()
+    instances = [(list(r), list(w)) for k in range(1, len(runners_up) + 1)
+                 for r, w in zip(itertools.combinations(runners_up, k), itertools.combinations(winners, k))]
+
+    def networkx_knockout(remaining_runners, remaining_winners):
+        graph = nx.Graph()
+        size = len(remaining_runners)
+        graph.add_nodes_from(range(size), bipartite=0)
+        graph.add_nodes_from(range(size, 2*size), bipartite=1)
+        for idx, r in enumerate(remaining_runners):
+            for fw in knockout_stage_simulator.filter_winners(r, remaining_winners):
+                graph.add_edge(idx, remaining_winners.index(fw) + size)
+        return len(nx.algorithms.bipartite.maximum_matching(graph)) == 2 * size
+
+    compare("Knockout stage", networkx_knockout, knockout_stage_simulator.exist_maximum_matching_for_knockout,
+            instances)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Draw configurations taken from the notebooks, used by the benchmarks.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'draw'))
+
+from team import Team
+
+
+def build_paired_clubs(clubs, pairs):
+    """
+    Build the dictionary of paired clubs (different TV timetable clubs) from a list of pairs of club names.
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param pairs: list of tuples containing club names
+    :return: a dictionary with club indexes as keys and values
+    """
+    paired_clubs = {}
+    for club1, club2 in pairs:
+        paired_clubs[clubs.index(club1)] = clubs.index(club2)
+        paired_clubs[clubs.index(club2)] = clubs.index(club1)
+    return paired_clubs
+
+
+def champions_league_2018_group_stage():
+    """
+    Champions League 2018-2019 group stage draw.
+    :return: a tuple with the positional arguments of simulate_draw after the number of simulations
+    """
+    clubs = ["Real Madrid", "Borussia Dortmund", "Liverpool", "Viktoria Plzen",
+             "Atletico Madrid", "Porto", "Schalke", "Club Brugge",
+             "Barcelona", "Manchester United", "Lyon", "Galatasaray",
+             "Bayern Munchen", "Shakhtar Donetsk", "Monaco", "Young Boys",
+             "Manchester City", "Benfica", "Ajax", "Internazionale Milano",
+             "Juventus", "Napoli", "CSKA Moskva", "Hoffenheim",
+             "Paris Saint-Germain", "Tottenham Hotspur", "PSV Eindhoven", "Crvena zvezda",
+             "Lokomotiv Moskva", "Roma", "Valencia", "AEK Athens"]
+    associations = ["ESP", "GER", "ENG", "CZE", "ESP", "POR", "GER", "BEL",
+                    "ESP", "ENG", "FRA", "TUR", "GER", "UKR", "FRA", "SUI",
+                    "ENG", "POR", "NED", "IRA", "ITA", "ITA", "RUS", "GER",
+                    "FRA", "ENG", "NED", "SER", "RUS", "ITA", "ESP", "GRE"]
+    # Force Russian and Ukrainian clubs to be in different groups
+    associations = ["RUS" if a == "UKR" else a for a in associations]
+    club_pots = [1, 2, 3, 4] * 8
+    number_of_pots = len(set(club_pots))
+    clubs_per_pot = len(clubs) // number_of_pots
+    paired_clubs = build_paired_clubs(clubs, [("Real Madrid", "Barcelona"), ("Atletico Madrid", "Valencia"),
+                                              ("Bayern Munchen", "Borussia Dortmund"),
+                                              ("Manchester City", "Tottenham Hotspur"),
+                                              ("Juventus", "Internazionale Milano"), ("Paris Saint-Germain", "Lyon"),
+                                              ("Lokomotiv Moskva", "CSKA Moskva"), ("Porto", "Benfica"),
+                                              ("Manchester United", "Liverpool"), ("Napoli", "Roma"),
+                                              ("Schalke", "Hoffenheim"), ("Ajax", "PSV Eindhoven")])
+    return (clubs, clubs_per_pot, number_of_pots, club_pots, associations, paired_clubs,
+            list(range(clubs_per_pot // 2)), list(range(clubs_per_pot // 2, clubs_per_pot)))
+
+
+def europa_league_2018_group_stage():
+    """
+    Europa League 2018-2019 group stage draw.
+    :return: a tuple with the positional arguments of simulate_draw after the number of simulations
+    """
+    clubs = ["Sevilla", "Arsenal", "Chelsea", "Zenit", "Bayer Leverkusen", "Dynamo Kyiv",
+             "Besiktas", "Salzburg", "Olympiacos", "Villarreal", "Anderlecht", "Lazio",
+             "Sporting CP", "Ludogorets", "Kobenhavn", "Marseille", "Celtic", "PAOK",
+             "AC Milan", "Genk", "Fenerbahce", "Krasnodar", "Astana", "Rapid Wien",
+             "Real Betis", "Qarabag", "BATE Borisov", "Dinamo Zagreb", "RB Leipzig", "Eintracht Frankfurt",
+             "Malmo", "Spartak Moskva", "Standard Liege", "Zurich", "Bordeaux", "Rennes",
+             "Apollon", "Rosenborg", "Vorskla Poltava", "Slavia Praha", "Akhisar Belediyespor", "Jablonec",
+             "AEK Larnaca", "Vidi", "Rangers", "Dudelange", "Spartak Trnava", "Sarpsborg"]
+    associations = ["ESP", "ENG", "ENG", "RUS", "GER", "UKR",
+                    "TUR", "AUT", "GRE", "ESP", "BEL", "ITA",
+                    "POR", "BUL", "DEN", "FRA", "SCO", "GRE",
+                    "ITA", "BEL", "TUR", "RUS", "KAZ", "AUT",
+                    "ESP", "AZE", "BLR", "CRO", "GER", "GER",
+                    "SWE", "RUS", "BEL", "SUI", "FRA", "FRA",
+                    "CYP", "NOR", "UKR", "CZE", "TUR", "CZE",
+                    "CYP", "HUN", "SCO", "LUX", "SVK", "NOR"]
+    club_pots = [1] * 12 + [2] * 12 + [3] * 12 + [4] * 12
+    number_of_pots = len(set(club_pots))
+    clubs_per_pot = len(clubs) // number_of_pots
+    # The first two clubs in each association have to be in different TV timetables
+    paired_clubs = {}
+    for association in set(associations):
+        club_indexes = [idx for idx, a in enumerate(associations) if a == association]
+        if len(club_indexes) > 1:
+            paired_clubs[club_indexes[0]] = club_indexes[1]
+            paired_clubs[club_indexes[1]] = club_indexes[0]
+    # Force Russian and Ukrainian clubs to be in different groups
+    associations = ["RUS" if a == "UKR" else a for a in associations]
+    return (clubs, clubs_per_pot, number_of_pots, club_pots, associations, paired_clubs,
+            list(range(clubs_per_pot // 2)), list(range(clubs_per_pot // 2, clubs_per_pot)))
+
+
+def world_cup_2018_group_stage():
+    """
+    World Cup 2018 group stage draw: at most two UEFA teams and one team of every other
+    confederation per group, and Russia (host) placed in the first group.
+    :return: a tuple (teams, pot number of each team, confederation of each team,
+             maximum number of teams of each confederation per group, dictionary (team: group) of hosts)
+    """
+    teams = ["Russia", "Germany", "Brazil", "Portugal", "Argentina", "Belgium", "Poland", "France",
+             "Spain", "Peru", "Switzerland", "England", "Colombia", "Mexico", "Uruguay", "Croatia",
+             "Denmark", "Iceland", "Costa Rica", "Sweden", "Tunisia", "Egypt", "Senegal", "Iran",
+             "Serbia", "Nigeria", "Australia", "Japan", "Morocco", "Panama", "South Korea", "Saudi Arabia"]
+    team_pots = [1] * 8 + [2] * 8 + [3] * 8 + [4] * 8
+    # UEFA, CONMEBOL, CONCACAF, CAF, AFC
+    team_confederations = [0, 0, 1, 0, 1, 0, 0, 0,
+                           0, 1, 0, 0, 1, 2, 1, 0,
+                           0, 0, 2, 0, 3, 3, 3, 4,
+                           0, 3, 4, 4, 3, 2, 4, 4]
+    confederation_caps = [2, 1, 1, 1, 1]
+    return teams, team_pots, team_confederations, confederation_caps, {teams.index("Russia"): 0}
+
+
+def champions_league_2018_knockout_stage():
+    """
+    Champions League 2018-2019 round of 16 draw.
+    :return: a tuple (runners-up, winners) of lists of Team instances
+    """
+    winners = [Team('Borussia Dortmund', 'Germany', 'A'), Team('Barcelona', 'Spain', 'B'),
+               Team('PSG', 'France', 'C'), Team('Porto', 'Portugal', 'D'),
+               Team('Bayern Munchen', 'Germany', 'E'), Team('Manchester City', 'England', 'F'),
+               Team('Real Madrid', 'Spain', 'G'), Team('Juventus', 'Italy', 'H')]
+    runners_up = [Team('Atletico Madrid', 'Spain', 'A'), Team('Tottenham', 'England', 'B'),
+                  Team('Liverpool', 'England', 'C'), Team('Schalke 04', 'Germany', 'D'),
+                  Team('Ajax', 'Netherlands', 'E'), Team('Olympique Lyonnais', 'France', 'F'),
+                  Team('Roma', 'Italy', 'G'), Team('Manchester United', 'England', 'H')]
+    return runners_up, winners
@@ -0,0 +1,155 @@
+"""
+Benchmark suite for the draw package: fixed seeds and the configurations of the notebooks.
+Throughput and peak memory of each benchmark are written into a JSON file, and a previous
+file can be given to compare the throughputs between commits.
+Throughputs are timed without tracing. Peak memory is the tracemalloc peak of a second run when available
+(Python 3) or the maximum resident set size of the process so far otherwise.
+Usage: python benchmarks/run.py [--output results.json] [--compare previous.json] [--quick]
+"""
+from __future__ import print_function
+import argparse
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+from configurations import (champions_league_2018_group_stage, champions_league_2018_knockout_stage,
+                            europa_league_2018_group_stage, world_cup_2018_group_stage)
+from engine import DrawEngine, LabelCap, PreAssignment
+from group_stage_simulator import estimate_probabilities, simulate_draw
+from knockout_stage_simulator import simulate_knockout_draws, unfold_probability_tree
+from world_cup_simulator import estimate_world_cup_probabilities
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SEED = 2018
+
+
+def measure(function):
+    """
+    Run a function measuring time and peak memory. Tracing allocations slows down the function several times,
+    so the peak memory is measured in a second run.
+    :param function: deterministic function without arguments
+    :return: a tuple (result, seconds, peak memory in KiB or None)
+    """
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1] / 1024.0
+        finally:
+            tracemalloc.stop()
+    elif resource is not None:
+        peak = float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)  # KiB on Linux
+    return result, elapsed, peak
+
+
+def build_sequential_world_cup_engine():
+    """
+    World Cup draw simulated team by team with the generic DrawEngine, to be compared with
+    the vectorized engine of world_cup_simulator.
+    :return: a DrawEngine instance
+    """
+    teams, team_pots, team_confederations, confederation_caps, hosts = world_cup_2018_group_stage()
+    return DrawEngine(team_pots, len(teams) // len(set(team_pots)),
+                      [LabelCap(team_confederations, confederation_caps), PreAssignment(hosts)],
+                      choose_first_group=True, avoid_dead_ends=False)
+
+
+def run_benchmarks(quick=False):
+    """
+    Run every benchmark.
+    :param quick: run just the smallest simulation counts
+    :return: a list of dictionaries (name, configuration, draws, seconds, draws_per_second, peak_memory_kib)
+    """
+    simulation_counts = [100] if quick else [100, 1000, 5000]
+    results = []
+
+    def record(name, configuration, draws, function):
+        result, elapsed, peak = measure(function)
+        results.append({'name': name, 'configuration': configuration, 'draws': draws, 'seconds': elapsed,
+                        'draws_per_second': draws / elapsed if elapsed > 0 else None, 'peak_memory_kib': peak})
+        print("%-34s %-18s %8d draws %9.3fs %12.1f draws/s" % (name, configuration, draws, elapsed,
+                                                               results[-1]['draws_per_second'] or 0))
+        return result
+
+    for configuration, arguments in (('champions_league', champions_league_2018_group_stage()),
+                                     ('europa_league', europa_league_2018_group_stage())):
+        for simulations in simulation_counts:
+            draws = record('simulate_draw', configuration, simulations,
+                           lambda: simulate_draw(simulations, *arguments, show_errors=False,
+                                                 random_state=np.random.RandomState(SEED)))
+        record('estimate_probabilities', configuration, draws.shape[0],
+               lambda: estimate_probabilities(draws, arguments[0], arguments[3]))
+
+    engine = build_sequential_world_cup_engine()
+    for simulations in simulation_counts:
+        draws = record('DrawEngine.simulate', 'world_cup', simulations,
+                       lambda: engine.simulate(simulations, np.random.RandomState(SEED)))
+    teams, team_pots = world_cup_2018_group_stage()[:2]
+    record('estimate_probabilities', 'world_cup', draws.shape[0],
+           lambda: estimate_probabilities(draws, teams, team_pots))
+    for simulations in [100 * n for n in simulation_counts]:
+        record('estimate_world_cup_probabilities', 'world_cup', simulations,
+               lambda: estimate_world_cup_probabilities(simulations, *world_cup_2018_group_stage()[1:], seed=SEED))
+
+    runners_up, winners = champions_league_2018_knockout_stage()
+    size = 5 if quick else 6
+    record('unfold_probability_tree', 'champions_league_%d' % size, 1,
+           lambda: sum([probability for _, probability in
+                        unfold_probability_tree(runners_up[:size], winners[:size], {}, 0.0)]))
+    for simulations in [10 * n for n in simulation_counts]:
+        record('simulate_knockout_draws', 'champions_league', simulations,
+               lambda: simulate_knockout_draws(runners_up, winners, simulations, np.random.RandomState(SEED)))
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_results):
+    """
+    Print the throughput of each benchmark relative to a previous run.
+    """
+    previous = dict(((r['name'], r['configuration'], r['draws']), r) for r in previous_results)
+    for result in results:
+        key = (result['name'], result['configuration'], result['draws'])
+        if key in previous and previous[key]['draws_per_second'] and result['draws_per_second']:
+            print("%-34s %-18s %8d draws %6.2fx" % (key + (result['draws_per_second'] /
+                                                           previous[key]['draws_per_second'],)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for the draw package")
+    parser.add_argument('--output', default='bench_output.json', help="JSON file for the results")
+    parser.add_argument('--compare', help="JSON file of a previous run to compare with")
+    parser.add_argument('--quick', action='store_true', help="run just the smallest simulation counts")
+    args = parser.parse_args()
+    results = run_benchmarks(args.quick)
+    report = {'commit': get_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+              'platform': platform.platform(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'seed': SEED, 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
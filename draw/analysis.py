@@ -0,0 +1,103 @@
+import numpy as np
+from constraints import GroupStageConstraints
+from group_stage_simulator import count_clubs_in_same_group, sample_uniform_draws, simulate_draw
+from knockout_stage_simulator import (build_eligible_winners, calculate_knockout_probabilities,
+                                      calculate_uniform_knockout_probabilities, simulate_knockout_draws)
+from utils import spawn_random_state
+
+
+def calculate_divergences(probabilities, reference, distributions):
+    """
+    Compare two probability matrices whose items are arranged in probability distributions
+    (e.g. the rivals of a club from another pot).
+    :param probabilities: numpy 2D-array of probabilities
+    :param reference: numpy 2D-array of reference probabilities with the same shape
+    :param distributions: list of (row indexes, column indexes) tuples selecting the items of each distribution
+    :return: a dictionary with the maximum absolute difference, and the maximum and mean total variation
+             and Kullback-Leibler divergence from the reference (inf if an item has probability but not reference)
+    """
+    total_variations, kl_divergences = [], []
+    for rows, columns in distributions:
+        p, q = probabilities[rows, columns], reference[rows, columns]
+        total_variations.append(0.5 * np.abs(p - q).sum())
+        support = p > 0
+        if (q[support] == 0).any():
+            kl_divergences.append(np.inf)
+        else:
+            kl_divergences.append(float(np.sum(p[support] * np.log(p[support] / q[support]))))
+    return {'max_abs_difference': float(np.abs(probabilities - reference).max()),
+            'max_total_variation': float(np.max(total_variations)),
+            'mean_total_variation': float(np.mean(total_variations)),
+            'max_kl_divergence': float(np.max(kl_divergences)),
+            'mean_kl_divergence': float(np.mean(kl_divergences))}
+
+
+def build_knockout_bias_report(runners_up, winners, simulations=None, seed=None):
+    """
+    Compare the fixture probabilities of the sequential procedure (a runner-up is drawn and then
+    a winner not leading to a dead end) with those of a draw taken uniformly from all the valid draws.
+    Both share the eligibility bitmasks. The uniform probabilities are always exact.
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :param simulations: number of simulated draws for the sequential procedure (exact probabilities if None)
+    :param seed: root seed of the simulations (random if None)
+    :return: a dictionary with both [winners]x[runners_up] probability matrices ('sequential' and 'uniform')
+             and the divergences of the sequential procedure from the uniform draw for each runner-up
+    """
+    eligible_winners = build_eligible_winners(runners_up, winners)
+    if simulations is None:
+        sequential = calculate_knockout_probabilities(runners_up, winners, eligible_winners=eligible_winners)
+    else:
+        random_state = np.random.RandomState() if seed is None else spawn_random_state(seed, 0)
+        sequential = simulate_knockout_draws(runners_up, winners, simulations, random_state,
+                                             eligible_winners=eligible_winners)
+    uniform = calculate_uniform_knockout_probabilities(runners_up, winners, eligible_winners)
+    report = calculate_divergences(sequential, uniform,
+                                   [(np.arange(len(winners)), runner_up) for runner_up in range(len(runners_up))])
+    report.update({'sequential': sequential, 'uniform': uniform})
+    return report
+
+
+def build_group_stage_bias_report(simulations, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                                  paired_clubs, groups_in_first_timetable, groups_in_second_timetable, seed=None):
+    """
+    Compare the probabilities of each pair of clubs to be in the same group in the sequential procedure
+    (simulate_draw) with those of a draw taken uniformly from all the valid draws (sample_uniform_draws).
+    Both are estimated with the same number of draws and share the constraint model.
+    5000 draws of the Champions League or the Europa League take less than a minute.
+    :param simulations: number of draws of each procedure
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param seed: root seed of the simulations (random if None)
+    :return: a dictionary with both [clubs]x[clubs] probability matrices ('sequential' and 'uniform'),
+             the divergences of the sequential procedure from the uniform draw for the rivals of each club
+             in each other pot, the largest standard error of the differences and the acceptance rate
+             of the uniform sampling
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    constraints = GroupStageConstraints(associations, paired_clubs, clubs_per_pot,
+                                        groups_in_first_timetable, groups_in_second_timetable)
+    arguments = (clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                 paired_clubs, groups_in_first_timetable, groups_in_second_timetable)
+    draws = simulate_draw(simulations, *arguments, show_errors=False, random_state=spawn_random_state(seed, 0),
+                          constraints=constraints)
+    sequential = count_clubs_in_same_group(draws, len(clubs)) / float(simulations)
+    draws, acceptance_rate = sample_uniform_draws(simulations, *arguments, random_state=spawn_random_state(seed, 1),
+                                                  return_acceptance_rate=True, constraints=constraints)
+    uniform = count_clubs_in_same_group(draws, len(clubs)) / float(simulations)
+    pots = [np.array([club for club, pot in enumerate(club_pots) if pot == pot_idx + 1])
+            for pot_idx in range(number_of_pots)]
+    report = calculate_divergences(sequential, uniform,
+                                   [(club, pot) for club in range(len(clubs)) for pot_idx, pot in enumerate(pots)
+                                    if club_pots[club] != pot_idx + 1])
+    standard_errors = np.sqrt((sequential * (1 - sequential) + uniform * (1 - uniform)) / simulations)
+    report.update({'sequential': sequential, 'uniform': uniform,
+                   'max_standard_error': float(standard_errors.max()), 'acceptance_rate': acceptance_rate})
+    return report
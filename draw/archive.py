@@ -0,0 +1,117 @@
+import json
+import os
+import numpy as np
+from group_stage_simulator import check_draw_dtype, simulate_draw_in_batches
+
+DRAWS_FILE = 'draws.npy'
+METADATA_FILE = 'metadata.json'
+
+
+def build_draw_metadata(clubs, club_pots, associations, paired_clubs,
+                        groups_in_first_timetable, groups_in_second_timetable, seed=None):
+    """
+    Gather the configuration of a group stage draw to be stored along with the simulated draws.
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param seed: root seed used to simulate the draws
+    :return: a dictionary
+    """
+    return {'clubs': list(clubs),
+            'club_pots': [int(pot) for pot in club_pots],
+            'associations': list(associations),
+            'paired_clubs': dict((int(c1), int(c2)) for c1, c2 in paired_clubs.items()),
+            'groups_in_first_timetable': [int(group) for group in groups_in_first_timetable],
+            'groups_in_second_timetable': [int(group) for group in groups_in_second_timetable],
+            'seed': None if seed is None else int(seed)}
+
+
+def create_draw_archive(path, simulations, clubs_per_pot, number_of_pots, metadata, dtype=np.int8):
+    """
+    Create an archive of draws: a directory containing a memory-mapped .npy file
+    for the draws and a JSON file for the metadata.
+    :param path: directory of the archive
+    :param simulations: number of draws to be stored
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param metadata: dictionary as returned by build_draw_metadata
+    :param dtype: integer type of the stored draws
+    :return: a writable [simulations]x[clubs_per_pot]x[number_of_pots] numpy memmap filled with -1
+    """
+    check_draw_dtype(dtype, len(metadata['clubs']))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    stored_metadata = dict(metadata)
+    # JSON objects only have string keys, so pairs of clubs are stored as a list
+    stored_metadata['paired_clubs'] = sorted([c1, c2] for c1, c2 in metadata['paired_clubs'].items())
+    with open(os.path.join(path, METADATA_FILE), 'w') as f:
+        json.dump(stored_metadata, f, indent=1)
+    draws = np.lib.format.open_memmap(os.path.join(path, DRAWS_FILE), mode='w+', dtype=dtype,
+                                      shape=(simulations, clubs_per_pot, number_of_pots))
+    draws[:] = -1
+    return draws
+
+
+def save_draws(path, draws, metadata):
+    """
+    Store an array of draws into a new archive.
+    :param path: directory of the archive
+    :param draws: [simulations]x[clubs_per_pot]x[number_of_pots] numpy 3D-array
+    :param metadata: dictionary as returned by build_draw_metadata
+    """
+    archived_draws = create_draw_archive(path, draws.shape[0], draws.shape[1], draws.shape[2], metadata, draws.dtype)
+    archived_draws[:] = draws
+    archived_draws.flush()
+
+
+def load_draws(path, mode='r'):
+    """
+    Open an archive of draws without reading the draws into memory.
+    :param path: directory of the archive
+    :param mode: memory-map mode ('r' read-only, 'r+' read and write, 'c' copy-on-write)
+    :return: a tuple (numpy memmap containing the draws, metadata dictionary)
+    """
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        metadata = json.load(f)
+    metadata['paired_clubs'] = dict((c1, c2) for c1, c2 in metadata['paired_clubs'])
+    return np.load(os.path.join(path, DRAWS_FILE), mmap_mode=mode), metadata
+
+
+def simulate_draw_to_archive(path, simulations, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                             paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                             seed=None, batch_size=10000, dtype=np.int8):
+    """
+    Simulate the draws in batches writing them straight into a new archive,
+    so memory does not depend on the number of simulations.
+    :param path: directory of the archive
+    :param simulations: The number of draws to be simulated
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param seed: root seed from which the random states of the batches are spawned (random if None)
+    :param batch_size: number of draws simulated at once
+    :param dtype: integer type of the stored draws
+    :return: a read-only numpy memmap containing the draws
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    metadata = build_draw_metadata(clubs, club_pots, associations, paired_clubs,
+                                   groups_in_first_timetable, groups_in_second_timetable, seed)
+    draws = create_draw_archive(path, simulations, clubs_per_pot, number_of_pots, metadata, dtype)
+    start = 0
+    for batch in simulate_draw_in_batches(batch_size, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                                          paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                                          simulations, seed, dtype):
+        draws[start:start + batch.shape[0]] = batch
+        start += batch.shape[0]
+    draws.flush()
+    del draws
+    return load_draws(path)[0]
@@ -0,0 +1,270 @@
+import collections
+import numpy as np
+from matching import complete_matching, iterate_bits
+
+
+class GroupStageConstraints:
+    """
+    Constraint model of a group stage draw, built once per tournament:
+        - club x club matrix of association conflicts
+        - timetable of each group (-1 for groups not belonging to any timetable)
+        - paired club of each club (-1 for clubs without TV constraints)
+    Feasibility checks are then lookups in these arrays using a running array
+    storing the group of each club (-1 for clubs not drawn yet).
+    """
+    def __init__(self, associations, paired_clubs, clubs_per_pot,
+                 groups_in_first_timetable, groups_in_second_timetable):
+        codes = dict((association, idx) for idx, association in enumerate(sorted(set(associations))))
+        self.number_of_clubs = len(associations)
+        self.number_of_groups = clubs_per_pot
+        self.associations = np.array([codes[association] for association in associations])
+        self.conflicts = self.associations[:, np.newaxis] == self.associations[np.newaxis, :]
+        np.fill_diagonal(self.conflicts, False)
+        self.timetables = np.full(clubs_per_pot, -1, dtype=int)
+        self.timetables[list(groups_in_first_timetable)] = 0
+        self.timetables[list(groups_in_second_timetable)] = 1
+        self.paired_clubs = np.full(self.number_of_clubs, -1, dtype=int)
+        for club, paired_club in paired_clubs.items():
+            self.paired_clubs[club] = paired_club
+        # Bitmask of each group, the extra last item (0) is selected by the position -1 of undrawn clubs
+        self.group_bits = np.append(1 << np.arange(clubs_per_pot), 0)
+        self.all_groups = (1 << clubs_per_pot) - 1
+        self.timetable_masks = [int(self.group_bits[:-1][self.timetables == timetable].sum())
+                                for timetable in (0, 1)]
+
+    def locate_clubs(self, draw):
+        """
+        Build the array storing the group of each club.
+        :param draw: 2-D numpy array containing the current state of the draw
+        :return: a numpy array containing the group of each club or -1 if the club has not been drawn yet
+        """
+        club_groups = np.full(self.number_of_clubs, -1, dtype=int)
+        groups, _ = np.where(draw > -1)
+        club_groups[draw[draw > -1]] = groups
+        return club_groups
+
+    def blocked_groups(self, club, club_groups):
+        """
+        Groups in which the club cannot be placed because of association or TV constraints.
+        :param club: club index
+        :param club_groups: numpy array containing the group of each club or -1
+        :return: a bitmask of groups
+        """
+        blocked = int(np.bitwise_or.reduce(self.group_bits[club_groups[self.conflicts[club]]]))
+        paired_club = self.paired_clubs[club]
+        if paired_club > -1:
+            paired_group = club_groups[paired_club]
+            if paired_group > -1 and self.timetables[paired_group] > -1:
+                blocked |= self.timetable_masks[self.timetables[paired_group]]
+        return blocked
+
+    def allowed_groups(self, club, club_groups, groups_mask=None):
+        """
+        Groups in which the club can be placed satisfying association and TV constraints.
+        :param club: club index
+        :param club_groups: numpy array containing the group of each club or -1
+        :param groups_mask: bitmask of groups to be considered (all groups if None)
+        :return: a bitmask of groups
+        """
+        groups_mask = self.all_groups if groups_mask is None else groups_mask
+        return groups_mask & ~self.blocked_groups(club, club_groups)
+
+    def count_groups_in_timetables(self, groups_mask):
+        """
+        Count the groups of groups_mask belonging to each timetable.
+        :param groups_mask: bitmask of groups
+        :return: a tuple of integers
+        """
+        return tuple(bin(groups_mask & mask).count('1') for mask in self.timetable_masks)
+
+    def count_clubs_forced_in_timetables(self, remaining_clubs, club_groups):
+        """
+        Count the clubs in remaining_clubs whose timetable is forced by their paired club,
+        and the number of pairs of remaining_clubs (to be split between both timetables).
+        :param remaining_clubs: list of indexes of the remaining clubs
+        :param club_groups: numpy array containing the group of each club or -1
+        :return: a tuple of integers (pairs, clubs forced in first timetable, clubs forced in second timetable)
+        """
+        pairs = 0
+        forced = [0, 0]
+        for club in remaining_clubs:
+            paired_club = self.paired_clubs[club]
+            if paired_club > -1:
+                paired_group = club_groups[paired_club]
+                if paired_group > -1:
+                    forced[1 if self.timetables[paired_group] == 0 else 0] += 1
+                elif paired_club in remaining_clubs:
+                    pairs += 1
+        return pairs // 2, forced[0], forced[1]
+
+    def is_valid_draw(self, draw):
+        """
+        Check whether or not a complete draw satisfies the association and TV constraints.
+        :param draw: a [clubs_per_pot]x[number_of_pots] numpy 2D-array containing club indexes
+        :return: a tuple (boolean, list of pairs of clubs breaking the TV constraints,
+                                   list of groups breaking the association constraint)
+        """
+        club_groups = self.locate_clubs(draw)
+        paired = np.where(self.paired_clubs > -1)[0]
+        timetables = self.timetables[club_groups[paired]]
+        tv_failures = paired[(timetables > -1) &
+                             (timetables == self.timetables[club_groups[self.paired_clubs[paired]]])]
+        associations = np.sort(self.associations[draw], axis=1)
+        association_failures = np.where((associations[:, 1:] == associations[:, :-1]).any(axis=1))[0]
+        return len(tv_failures) == 0 and len(association_failures) == 0, tv_failures, association_failures
+
+
+class CompletionOracle:
+    """
+    Check whether a partial group stage draw can be completed satisfying every constraint,
+    searching depth-first pot by pot and placing first the club with the fewest allowed groups.
+    The result of each partial draw with complete pots is memoized by its canonical key (groups of
+    the same timetable are interchangeable), so the partial draws shared by many simulated draws are searched once.
+    """
+    def __init__(self, constraints, pots, max_memo_size=1000000):
+        """
+        :param constraints: GroupStageConstraints instance
+        :param pots: list with the list of clubs of each pot
+        :param max_memo_size: maximum number of partial draws memoized (the memo is cleared when exceeded)
+        """
+        self.constraints = constraints
+        self.pots = [list(clubs) for clubs in pots]
+        self.club_pots = dict((club, pot_idx) for pot_idx, clubs in enumerate(self.pots) for club in clubs)
+        self.associations = [int(association) for association in constraints.associations]
+        self.paired_clubs = [int(paired_club) for paired_club in constraints.paired_clubs]
+        self.timetables = [int(timetable) for timetable in constraints.timetables]
+        self.timetable_groups = [[g for g in range(constraints.number_of_groups) if self.timetables[g] == timetable]
+                                 for timetable in (-1, 0, 1)]
+        self.max_memo_size = max_memo_size
+        self.memo = {}
+        self.witnesses = collections.deque(maxlen=constraints.number_of_groups)
+        self.calls = 0
+        self.searched_states = 0
+
+    def allowed_groups(self, club, available_groups):
+        """
+        Available groups in which the club can be placed satisfying association and TV constraints.
+        :param club: club index
+        :param available_groups: bitmask of groups
+        :return: a bitmask of groups
+        """
+        allowed = available_groups & ~self.association_groups[self.associations[club]]
+        paired_club = self.paired_clubs[club]
+        if paired_club > -1 and self.club_groups[paired_club] > -1:
+            timetable = self.timetables[self.club_groups[paired_club]]
+            if timetable > -1:
+                allowed &= ~self.constraints.timetable_masks[timetable]
+        return allowed
+
+    def swap_in_witness(self, witness, club, group):
+        """
+        Try to repair a complete draw moving the club to the group and the club of the same pot
+        in that group to the former group of the club.
+        :param witness: list with the group of each club in a complete valid draw
+        :param club: club index
+        :param group: new group of the club
+        :return: the repaired draw as a list, or None if it breaks any constraint
+        """
+        former_group = witness[club]
+        other_club = [c for c in self.pots[self.club_pots[club]] if witness[c] == group][0]
+        if self.club_groups[other_club] > -1:
+            return None
+        repaired_witness = list(witness)
+        repaired_witness[club], repaired_witness[other_club] = group, former_group
+        for moved_club in (club, other_club):
+            moved_group = repaired_witness[moved_club]
+            association = self.associations[moved_club]
+            if any([repaired_witness[c] == moved_group and self.associations[c] == association and c != moved_club
+                    for c in range(len(repaired_witness))]):
+                return None
+            paired_club = self.paired_clubs[moved_club]
+            if paired_club > -1 and self.timetables[moved_group] > -1 and \
+                    self.timetables[moved_group] == self.timetables[repaired_witness[paired_club]]:
+                return None
+        return repaired_witness
+
+    def get_key(self):
+        """
+        Canonical key of the current partial draw.
+        :return: a hashable tuple
+        """
+        return tuple(tuple(sorted(tuple(self.compositions[g]) for g in groups)) for groups in self.timetable_groups)
+
+    def can_complete(self, club_groups):
+        """
+        Check whether the partial draw can be completed. The pots are drawn in order,
+        so the clubs not drawn yet are those of the first pot with clubs out of the groups and the following pots.
+        The last completions found are kept as witnesses: partial draws agreeing with one of them are completed at once.
+        :param club_groups: group of each club or -1 for the clubs not drawn yet
+        :return: a boolean
+        """
+        self.calls += 1
+        self.club_groups = [int(group) for group in club_groups]
+        for witness in self.witnesses:
+            disagreements = [club for club, group in enumerate(self.club_groups)
+                             if group > -1 and group != witness[club]]
+            if len(disagreements) == 0:
+                return True
+            if len(disagreements) == 1:
+                repaired_witness = self.swap_in_witness(witness, disagreements[0], self.club_groups[disagreements[0]])
+                if repaired_witness is not None:
+                    self.witnesses.append(repaired_witness)
+                    return True
+        if len(self.memo) > self.max_memo_size:
+            self.memo = {}
+        self.association_groups = [0] * (max(self.associations) + 1)
+        self.compositions = [[] for _ in range(self.constraints.number_of_groups)]
+        for pot in self.pots:
+            for club in pot:
+                if self.club_groups[club] > -1:
+                    self.association_groups[self.associations[club]] |= 1 << self.club_groups[club]
+                    self.compositions[self.club_groups[club]].append(club)
+        for pot_idx, pot in enumerate(self.pots):
+            remaining_clubs = [club for club in pot if self.club_groups[club] == -1]
+            if len(remaining_clubs) > 0:
+                available_groups = self.constraints.all_groups
+                for club in pot:
+                    if self.club_groups[club] > -1:
+                        available_groups &= ~(1 << self.club_groups[club])
+                return self.search(pot_idx, remaining_clubs, available_groups)
+        return True
+
+    def search(self, pot_idx, remaining_clubs, available_groups, matching=None):
+        """
+        Depth-first search of a completion of the current partial draw. Partial draws are memoized
+        when a pot starts, while inside a pot the remaining clubs must have a matching to the available groups,
+        whose group for the club placed first is tried before the others.
+        :param pot_idx: index of the pot being drawn
+        :param remaining_clubs: list of clubs of the pot not drawn yet
+        :param available_groups: bitmask of groups without a club of the pot
+        :param matching: dictionary (group: club) with the matching of the parent search to be repaired
+        :return: a boolean
+        """
+        if len(remaining_clubs) == 0:
+            if pot_idx + 1 == len(self.pots):
+                self.witnesses.append(list(self.club_groups))
+                return True
+            key = self.get_key()
+            if key not in self.memo:
+                self.memo[key] = self.search(pot_idx + 1, self.pots[pot_idx + 1], self.constraints.all_groups)
+            return self.memo[key]
+        self.searched_states += 1
+        adjacency = dict((club, self.allowed_groups(club, available_groups)) for club in remaining_clubs)
+        matching = {} if matching is None else dict(matching)
+        if not complete_matching(adjacency, matching):
+            return False
+        best_club = min(remaining_clubs, key=lambda club: bin(adjacency[club]).count('1'))
+        matched_group = [group for group, club in matching.items() if club == best_club][0]
+        other_clubs = [club for club in remaining_clubs if club != best_club]
+        association = self.associations[best_club]
+        for group in [matched_group] + [g for g in iterate_bits(adjacency[best_club]) if g != matched_group]:
+            self.club_groups[best_club] = group
+            self.association_groups[association] |= 1 << group
+            self.compositions[group].append(best_club)
+            completed = self.search(pot_idx, other_clubs, available_groups & ~(1 << group), matching)
+            self.compositions[group].pop()
+            self.association_groups[association] &= ~(1 << group)
+            self.club_groups[best_club] = -1
+            if completed:
+                return True
+        return False
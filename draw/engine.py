@@ -0,0 +1,349 @@
+import numpy as np
+from matching import complete_matching, iterate_bits
+
+
+class LabelCap:
+    """
+    Rule limiting the number of teams sharing a label (association, confederation...) in the same group.
+    """
+    def __init__(self, labels, caps=1):
+        """
+        :param labels: label of each team
+        :param caps: maximum number of teams with the same label in a group, either a number
+                     for every label or a dictionary with labels as keys
+        """
+        self.labels = list(labels)
+        self.caps = caps
+
+
+class CountryProtection(LabelCap):
+    """
+    Rule forbidding two teams with the same label (country, previous group...) in the same group or fixture.
+    """
+    def __init__(self, countries):
+        """
+        :param countries: country of each team
+        """
+        LabelCap.__init__(self, countries, 1)
+
+
+class TimetableSeparation:
+    """
+    Rule placing paired teams in groups playing in different timetables.
+    """
+    def __init__(self, paired_teams, groups_in_first_timetable, groups_in_second_timetable):
+        """
+        :param paired_teams: dictionary with team indexes as keys and their paired team as values
+        :param groups_in_first_timetable: first list of groups playing the same day
+        :param groups_in_second_timetable: second list of groups playing the same day
+        """
+        self.paired_teams = dict(paired_teams)
+        self.groups_in_first_timetable = list(groups_in_first_timetable)
+        self.groups_in_second_timetable = list(groups_in_second_timetable)
+
+
+class PreAssignment:
+    """
+    Rule placing some teams (hosts, seeded teams in knockouts...) in a given group before their pot is drawn.
+    """
+    def __init__(self, assignments):
+        """
+        :param assignments: dictionary with team indexes as keys and groups as values
+        """
+        self.assignments = dict(assignments)
+
+
+class DrawEngine:
+    """
+    Draw of teams into groups pot by pot, compiling a list of declarative rules into a feasibility kernel:
+        - bitmask of the groups allowed for each team by the pre-assignments
+        - counters of each (rule, label) per group and the bitmask of groups where the label is full
+        - timetable of each group and paired team of each team
+    The state of the draw in progress is updated in place as teams are assigned, so evaluating the candidate
+    groups of a team applies and undoes tentative assignments without copying or recounting anything.
+    At each step a team is drawn at random from its pot and assigned to a random (or the first) feasible group.
+    Feasible groups are the allowed ones that, if avoid_dead_ends, still let the rest of the pot be placed.
+    """
+    def __init__(self, team_pots, number_of_groups, rules, choose_first_group=False, avoid_dead_ends=True):
+        """
+        :param team_pots: pot number of each team (starting at 1)
+        :param number_of_groups: number of groups
+        :param rules: list of LabelCap, CountryProtection, TimetableSeparation and PreAssignment instances
+        :param choose_first_group: assign the first feasible group instead of a random one
+        :param avoid_dead_ends: discard the groups leading to a dead end in the pot
+                                (otherwise dead ends restart the draw)
+        """
+        self.number_of_teams = len(team_pots)
+        self.number_of_groups = number_of_groups
+        self.number_of_pots = len(set(team_pots))
+        self.pots = [[team for team, pot in enumerate(team_pots) if pot == pot_idx + 1]
+                     for pot_idx in range(self.number_of_pots)]
+        if any([len(teams) > number_of_groups for teams in self.pots]):
+            raise ValueError("Every pot must have at most %d teams" % number_of_groups)
+        self.choose_first_group = choose_first_group
+        self.avoid_dead_ends = avoid_dead_ends
+        self.all_groups = (1 << number_of_groups) - 1
+        self.fixed_groups = [None] * self.number_of_teams
+        self.team_counters = [[] for _ in range(self.number_of_teams)]
+        self.caps = []
+        self.paired_teams = [-1] * self.number_of_teams
+        self.timetables = [-1] * number_of_groups
+        self.timetable_masks = [0, 0]
+        for rule in rules:
+            self.compile_rule(rule)
+
+    def compile_rule(self, rule):
+        """
+        Add a rule to the feasibility kernel.
+        :param rule: LabelCap, CountryProtection, TimetableSeparation or PreAssignment instance
+        """
+        if isinstance(rule, LabelCap):
+            if len(rule.labels) != self.number_of_teams:
+                raise ValueError("Expected %d labels, got %d" % (self.number_of_teams, len(rule.labels)))
+            counters = {}
+            for team, label in enumerate(rule.labels):
+                if label not in counters:
+                    counters[label] = len(self.caps)
+                    self.caps.append(rule.caps[label] if isinstance(rule.caps, (dict, list)) else rule.caps)
+                self.team_counters[team].append(counters[label])
+        elif isinstance(rule, TimetableSeparation):
+            for group in rule.groups_in_first_timetable:
+                self.timetables[group] = 0
+            for group in rule.groups_in_second_timetable:
+                self.timetables[group] = 1
+            self.timetable_masks = [sum([1 << g for g in range(self.number_of_groups) if self.timetables[g] == t])
+                                    for t in (0, 1)]
+            for team, paired_team in rule.paired_teams.items():
+                self.paired_teams[team] = paired_team
+        elif isinstance(rule, PreAssignment):
+            for team, group in rule.assignments.items():
+                self.fixed_groups[team] = group
+        else:
+            raise ValueError("Unknown rule: %s" % rule)
+
+    def reset(self):
+        """
+        Start a new draw with every team undrawn.
+        """
+        self.team_groups = [-1] * self.number_of_teams
+        self.counts = [[0] * self.number_of_groups for _ in self.caps]
+        self.full_groups = [0] * len(self.caps)
+        self.available_groups = self.all_groups
+        self.remaining_teams = set()
+        self.pairs = 0
+        self.forced = [0, 0]
+        self.matching = {}
+        self.matching_calls = 0
+
+    def paired_timetable(self, team):
+        """
+        Timetable of the group of the paired team.
+        :param team: team index
+        :return: 0, 1 or -1 (group without timetable), or None if the team is not paired
+                 or its paired team has not been drawn yet
+        """
+        paired_team = self.paired_teams[team]
+        if paired_team == -1 or self.team_groups[paired_team] == -1:
+            return None
+        return self.timetables[self.team_groups[paired_team]]
+
+    def forced_counter(self, team):
+        """
+        Counter of forced teams to which the team belongs.
+        :param team: team index
+        :return: 0 or 1, or -1 if the team is not forced by its paired team
+        """
+        timetable = self.paired_timetable(team)
+        if timetable is None:
+            return -1
+        return 1 if timetable == 0 else 0
+
+    def start_pot(self, teams):
+        """
+        Start the draw of a pot, counting the timetable constraints of its teams.
+        :param teams: list of indexes of the teams in the pot
+        """
+        self.available_groups = self.all_groups
+        self.remaining_teams = set(teams)
+        self.forced = [0, 0]
+        self.pairs = 0
+        for team in teams:
+            counter = self.forced_counter(team)
+            if counter > -1:
+                self.forced[counter] += 1
+            elif self.paired_teams[team] in self.remaining_teams:
+                self.pairs += 1
+        self.pairs //= 2
+        self.matching = {}
+
+    def remove_team(self, team):
+        """
+        Take the drawn team out of the remaining teams of the pot.
+        :param team: team index
+        """
+        self.remaining_teams.remove(team)
+        counter = self.forced_counter(team)
+        if counter > -1:
+            self.forced[counter] -= 1
+        elif self.paired_teams[team] in self.remaining_teams:
+            self.pairs -= 1
+
+    def assign(self, team, group):
+        """
+        Assign the team, already removed from the remaining teams, to a group.
+        :param team: team index
+        :param group: group index
+        """
+        self.team_groups[team] = group
+        for counter in self.team_counters[team]:
+            self.counts[counter][group] += 1
+            if self.counts[counter][group] >= self.caps[counter]:
+                self.full_groups[counter] |= 1 << group
+        self.available_groups &= ~(1 << group)
+        if self.paired_teams[team] in self.remaining_teams:
+            self.forced[self.forced_counter(self.paired_teams[team])] += 1
+
+    def unassign(self, team):
+        """
+        Undo the assignment of the team to its group.
+        :param team: team index
+        """
+        if self.paired_teams[team] in self.remaining_teams:
+            self.forced[self.forced_counter(self.paired_teams[team])] -= 1
+        group = self.team_groups[team]
+        for counter in self.team_counters[team]:
+            self.counts[counter][group] -= 1
+            if self.counts[counter][group] < self.caps[counter]:
+                self.full_groups[counter] &= ~(1 << group)
+        self.available_groups |= 1 << group
+        self.team_groups[team] = -1
+
+    def allowed_groups(self, team):
+        """
+        Available groups in which the team can be placed satisfying every rule.
+        :param team: team index
+        :return: a bitmask of groups
+        """
+        allowed = self.available_groups
+        if self.fixed_groups[team] is not None:
+            allowed &= 1 << self.fixed_groups[team]
+        for counter in self.team_counters[team]:
+            allowed &= ~self.full_groups[counter]
+        timetable = self.paired_timetable(team)
+        if timetable is not None and timetable > -1:
+            allowed &= ~self.timetable_masks[timetable]
+        return allowed
+
+    def has_no_dead_ends(self):
+        """
+        Check whether the remaining teams of the pot can still be placed in the available groups.
+        :return: a boolean
+        """
+        groups_in_timetables = [bin(self.available_groups & mask).count('1') for mask in self.timetable_masks]
+        if any([groups_in_timetables[t] < self.pairs + self.forced[t] for t in (0, 1)]):
+            return False
+        adjacency = dict((team, self.allowed_groups(team)) for team in self.remaining_teams)
+        self.matching_calls += 1
+        return complete_matching(adjacency, self.matching)
+
+    def feasible_groups(self, team):
+        """
+        Groups to which the drawn team can be assigned.
+        :param team: team index, already removed from the remaining teams
+        :return: the list of feasible groups in increasing order
+        """
+        candidates = self.allowed_groups(team)
+        if not self.avoid_dead_ends:
+            return list(iterate_bits(candidates))
+        feasible_groups = []
+        for group in iterate_bits(candidates):
+            self.assign(team, group)
+            try:
+                if self.has_no_dead_ends():
+                    feasible_groups.append(group)
+            finally:
+                self.unassign(team)
+        return feasible_groups
+
+    def draw(self, random_state):
+        """
+        Simulate a single draw.
+        :param random_state: numpy RandomState
+        :return: a [number_of_groups]x[number_of_pots] numpy 2D-array containing team indexes,
+                 or None if the draw reached a dead end
+        """
+        self.reset()
+        draw = np.full((self.number_of_groups, self.number_of_pots), -1, dtype=int)
+        for pot_idx, teams in enumerate(self.pots):
+            teams_in_pot = [team for team in teams if self.fixed_groups[team] is None]
+            self.start_pot(teams)
+            for team in teams:
+                if self.fixed_groups[team] is not None:
+                    self.remove_team(team)
+                    if not self.allowed_groups(team):
+                        return None
+                    self.assign(team, self.fixed_groups[team])
+                    draw[self.fixed_groups[team], pot_idx] = team
+            while len(teams_in_pot) > 0:
+                team = random_state.choice(teams_in_pot)
+                teams_in_pot.remove(team)
+                self.remove_team(team)
+                feasible_groups = self.feasible_groups(team)
+                if len(feasible_groups) == 0:
+                    return None
+                group = feasible_groups[0] if self.choose_first_group else random_state.choice(feasible_groups)
+                self.assign(team, int(group))
+                draw[group, pot_idx] = team
+        return draw
+
+    def simulate(self, simulations, random_state=None, dtype=int):
+        """
+        Simulate the number of draws required, restarting the draws reaching a dead end.
+        :param simulations: number of draws to be simulated
+        :param random_state: numpy RandomState (numpy global state if None)
+        :param dtype: integer type of the array of draws
+        :return: a [simulations]x[number_of_groups]x[number_of_pots] numpy 3D-array containing team indexes
+        """
+        rng = np.random if random_state is None else random_state
+        draws = np.full((simulations, self.number_of_groups, self.number_of_pots), -1, dtype=dtype)
+        simulation = 0
+        while simulation < simulations:
+            draw = self.draw(rng)
+            if draw is not None:
+                draws[simulation] = draw
+                simulation += 1
+        return draws
+
+
+def build_group_stage_engine(clubs_per_pot, club_pots, associations, paired_clubs,
+                             groups_in_first_timetable, groups_in_second_timetable):
+    """
+    Draw engine for the Champions League and Europa League group stages, used by simulate_draw.
+    :param clubs_per_pot: number of clubs in each pot
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :return: a DrawEngine instance
+    """
+    return DrawEngine(club_pots, clubs_per_pot,
+                      [CountryProtection(associations),
+                       TimetableSeparation(paired_clubs, groups_in_first_timetable, groups_in_second_timetable)])
+
+
+def build_knockout_engine(runners_up, winners):
+    """
+    Draw engine for the knockout stage: the i-th winner is pre-assigned to the i-th fixture (group),
+    and the runners-up are drawn against winners of different country and different previous group.
+    Teams are indexed as winners followed by runners-up, so in the draws the runner-up playing
+    the i-th winner is draws[:, i, 1] - len(winners).
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :return: a DrawEngine instance
+    """
+    teams = list(winners) + list(runners_up)
+    return DrawEngine([1] * len(winners) + [2] * len(runners_up), len(winners),
+                      [CountryProtection([team.country for team in teams]),
+                       CountryProtection([team.group for team in teams]),
+                       PreAssignment(dict((idx, idx) for idx in range(len(winners))))])
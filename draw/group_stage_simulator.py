@@ -1,7 +1,14 @@
-import networkx as nx
 import numpy as np
 import collections
-from utils import copy_list_and_remove_element
+import itertools
+import math
+import multiprocessing
+import time
+from constraints import CompletionOracle, GroupStageConstraints
+from engine import build_group_stage_engine
+from matching import complete_matching
+from utils import (binomial_coefficient, copy_list_and_remove_element, spawn_random_state, spawn_random_states,
+                   unrank_permutation)
 
 
 def filter_groups(club, groups, updated_draw, associations, paired_clubs,
@@ -25,13 +32,14 @@ def filter_groups(club, groups, updated_draw, associations, paired_clubs,
 
 
 def exist_maximum_matching(remaining_clubs, remaining_groups, updated_draw, associations,
-                           paired_clubs, groups_in_first_timetable, groups_in_second_timetable):
+                           paired_clubs, groups_in_first_timetable, groups_in_second_timetable, matching=None,
+                           constraints=None, club_groups=None):
     """
     A bipartite graph is built using remaining_clubs (first class) and
     remaining_groups (second class). For each club, eligible groups are calculated,
     and for each of these pairs of nodes (1st class, 2nd class) an edge is built.
-    If the maximum matching for this bipartite graph is exactly the sum of
-    the sizes of remaining_clubs and remaining_groups, then there is no dead ends yet.
+    If every club can be matched to a different group (both classes have the same size),
+    then there is no dead ends yet.
     :param remaining_clubs: list of indexes of the remaining clubs
     :param remaining_groups: list of groups that have not been assigned yet
     :param updated_draw: 2-D numpy array containing the current state of the draw
@@ -39,19 +47,20 @@ def exist_maximum_matching(remaining_clubs, remaining_groups, updated_draw, asso
     :param paired_clubs: pairs of clubs having opposite timetables
     :param groups_in_first_timetable: first list of groups playing the same day
     :param groups_in_second_timetable: second list of groups playing the same day
+    :param matching: dictionary (group: club) with a previous matching to be repaired instead of
+                     starting from scratch. It is updated in place
+    :param constraints: GroupStageConstraints instance (built from the previous arguments if None)
+    :param club_groups: group of each club in the current state of the draw (located in updated_draw if None)
     :return: a boolean
     """
-    graph = nx.Graph()
-    size = len(remaining_clubs)
-    graph.add_nodes_from(range(size), bipartite=0)
-    graph.add_nodes_from(range(size, 2*size), bipartite=1)
-    for idx, c in enumerate(remaining_clubs):
-        for fg in filter_groups(c, remaining_groups, updated_draw, associations, paired_clubs,
-                                groups_in_first_timetable, groups_in_second_timetable):
-            g_idx = remaining_groups.index(fg)
-            graph.add_edge(idx, g_idx + size)
-    max_size = len(nx.algorithms.bipartite.maximum_matching(graph))
-    return max_size == 2 * size
+    if constraints is None:
+        constraints = GroupStageConstraints(associations, paired_clubs, updated_draw.shape[0],
+                                            groups_in_first_timetable, groups_in_second_timetable)
+    if club_groups is None:
+        club_groups = constraints.locate_clubs(updated_draw)
+    groups_mask = sum([1 << g for g in remaining_groups])
+    adjacency = dict((c, constraints.allowed_groups(c, club_groups, groups_mask)) for c in remaining_clubs)
+    return complete_matching(adjacency, matching)
 
 
 def is_group_in_timetable(group, groups_in_first_timetable, groups_in_second_timetable, first_timetable=True):
@@ -142,7 +151,8 @@ def get_numbers_of_pending_clubs_tv_constrained(draw, remaining_clubs, paired_cl
 
 
 def has_no_dead_ends(draw, drawn_club_index, group_candidate, remaining_clubs, groups_available, pot,
-                     paired_clubs, associations, groups_in_first_timetable, groups_in_second_timetable):
+                     paired_clubs, associations, groups_in_first_timetable, groups_in_second_timetable,
+                     matching=None, constraints=None, club_groups=None):
     """
     Check whether after assigning drawn_club to group,
     there will be a dead end in the draw of remaining_clubs and groups_available.
@@ -156,31 +166,34 @@ def has_no_dead_ends(draw, drawn_club_index, group_candidate, remaining_clubs, g
     :param associations: association of each club
     :param groups_in_first_timetable: first list of groups playing the same day
     :param groups_in_second_timetable: second list of groups playing the same day
+    :param matching: dictionary (group: club) with a previous matching to be repaired (updated in place)
+    :param constraints: GroupStageConstraints instance (built from the previous arguments if None)
+    :param club_groups: group of each club in the current state of the draw (located in draw if None)
     :return: a boolean
     """
-    updated_draw = np.copy(draw)
-    updated_draw[group_candidate, pot] = drawn_club_index
+    if constraints is None:
+        constraints = GroupStageConstraints(associations, paired_clubs, draw.shape[0],
+                                            groups_in_first_timetable, groups_in_second_timetable)
+    if club_groups is None:
+        club_groups = constraints.locate_clubs(draw)
     remaining_groups = copy_list_and_remove_element(group_candidate, groups_available)
-    paired_clubs_in_pot = sum([1 if c in paired_clubs and paired_clubs[c] in remaining_clubs else 0
-                               for c in remaining_clubs])
-    pairs = paired_clubs_in_pot / 2
-    clubs_forced_in_19h, clubs_forced_in_21h = get_numbers_of_pending_clubs_tv_constrained(updated_draw,
-                                                                                           remaining_clubs,
-                                                                                           paired_clubs,
-                                                                                           groups_in_first_timetable,
-                                                                                           groups_in_second_timetable)
-    groups_in_19h = len([g for g in remaining_groups if is_group_in_timetable(g, groups_in_first_timetable,
-                                                                              groups_in_second_timetable)])
-    groups_in_21h = len([g for g in remaining_groups if is_group_in_timetable(g, groups_in_first_timetable,
-                                                                              groups_in_second_timetable, False)])
-    if (groups_in_19h < pairs + clubs_forced_in_19h) or (groups_in_21h < pairs + clubs_forced_in_21h):
-        return False
-    return exist_maximum_matching(remaining_clubs, remaining_groups, updated_draw, associations,
-                                  paired_clubs, groups_in_first_timetable, groups_in_second_timetable)
+    club_groups[drawn_club_index] = group_candidate  # tentative assignment, undone before returning
+    try:
+        pairs, clubs_forced_in_19h, clubs_forced_in_21h = \
+            constraints.count_clubs_forced_in_timetables(remaining_clubs, club_groups)
+        groups_in_19h, groups_in_21h = constraints.count_groups_in_timetables(sum([1 << g for g in remaining_groups]))
+        if (groups_in_19h < pairs + clubs_forced_in_19h) or (groups_in_21h < pairs + clubs_forced_in_21h):
+            return False
+        return exist_maximum_matching(remaining_clubs, remaining_groups, draw, associations,
+                                      paired_clubs, groups_in_first_timetable, groups_in_second_timetable, matching,
+                                      constraints, club_groups)
+    finally:
+        club_groups[drawn_club_index] = -1
 
 
 def get_feasible_groups(draw, drawn_club_index, remaining_clubs, groups_available, pot,
-                        associations, paired_clubs, groups_in_first_timetable, groups_in_second_timetable):
+                        associations, paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                        constraints=None, club_groups=None, engine=None, cache=None):
     """
     Return the first feasible group for drawn_club satisfying the draw constraints
     about TV timetables, same association clubs, and dead ends.
@@ -195,23 +208,115 @@ def get_feasible_groups(draw, drawn_club_index, remaining_clubs, groups_availabl
     :param paired_clubs: pairs of clubs having opposite timetables
     :param groups_in_first_timetable: first list of groups playing the same day
     :param groups_in_second_timetable: second list of groups playing the same day
+    :param constraints: GroupStageConstraints instance (built from the previous arguments if None)
+    :param club_groups: group of each club in the current state of the draw (located in draw if None)
+    :param engine: group stage DrawEngine instance kept up to date with the draw. If given, the candidate groups
+                   are evaluated in place on it and the previous arguments are ignored
+    :param cache: FeasibleGroupsCache instance looked up before evaluating the candidate groups (requires draw)
     :return: the list of feasible groups available for the drawn club
     """
+    if cache is not None and pot < cache.number_of_pots:
+        key, groups = cache.get_canonical_form(draw, drawn_club_index)
+        positions = cache.get(key)
+        if positions is None:
+            feasible_groups = get_feasible_groups(draw, drawn_club_index, remaining_clubs, groups_available, pot,
+                                                  associations, paired_clubs, groups_in_first_timetable,
+                                                  groups_in_second_timetable, constraints, club_groups, engine)
+            cache.put(key, [groups.index(group) for group in feasible_groups])
+            return feasible_groups
+        return sorted([groups[position] for position in positions])
+    if engine is not None:
+        return engine.feasible_groups(drawn_club_index)
+    if constraints is None:
+        constraints = GroupStageConstraints(associations, paired_clubs, draw.shape[0],
+                                            groups_in_first_timetable, groups_in_second_timetable)
+    if club_groups is None:
+        club_groups = constraints.locate_clubs(draw)
     feasible_groups = []
-    association = associations[drawn_club_index]
+    allowed_groups = constraints.allowed_groups(drawn_club_index, club_groups)
+    matching = {}  # reused by the candidates, which just differ in a few edges
     for group in groups_available:
-        if is_tv_constraint_satisfied(draw, drawn_club_index, group,
-                                      paired_clubs, groups_in_first_timetable, groups_in_second_timetable):
-            if has_no_same_association_club_in_group(draw[group, :], association, associations):
-                if has_no_dead_ends(draw, drawn_club_index, group, remaining_clubs, groups_available, pot,
-                                    paired_clubs, associations, groups_in_first_timetable, groups_in_second_timetable):
-                    feasible_groups.append(group)
-                    # return feasible_groups
+        if allowed_groups >> group & 1:
+            if has_no_dead_ends(draw, drawn_club_index, group, remaining_clubs, groups_available, pot,
+                                paired_clubs, associations, groups_in_first_timetable, groups_in_second_timetable,
+                                matching, constraints, club_groups):
+                feasible_groups.append(group)
+                # return feasible_groups
     return feasible_groups
 
 
+class FeasibleGroupsCache:
+    """
+    Bounded LRU cache of the feasible groups of a drawn club for a partial draw, shared by many simulations
+    of the same tournament. Groups of the same timetable with the same clubs are interchangeable,
+    so partial draws are encoded canonically as the sorted list of (timetable, clubs) of the groups and
+    feasible groups are stored as positions in that list. Counters:
+        - hits: lookups answered by the cache
+        - misses: lookups requiring the feasibility checks
+        - evictions: least recently used entries removed to keep at most max_size entries
+    Partial draws hardly ever repeat after the first pots, so just the first number_of_pots pots are cached.
+    """
+    def __init__(self, timetables, max_size=100000, number_of_pots=1):
+        self.timetables = [int(timetable) for timetable in timetables]
+        self.max_size = max_size
+        self.number_of_pots = number_of_pots
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_canonical_form(self, draw, drawn_club):
+        """
+        Build the canonical key of a partial draw and the drawn club.
+        :param draw: [clubs_per_pot]x[number_of_pots] numpy 2D-array with the partial draw
+        :param drawn_club: index of the drawn club
+        :return: a tuple (hashable key, list of groups ordered as in the key)
+        """
+        signatures = sorted([(timetable, tuple(clubs), group)
+                             for group, (timetable, clubs) in enumerate(zip(self.timetables, draw.tolist()))])
+        return (drawn_club,) + tuple([signature[:2] for signature in signatures]), \
+            [signature[2] for signature in signatures]
+
+    def get(self, key):
+        """
+        :param key: canonical key
+        :return: the positions of the feasible groups, or None if the key is not cached
+        """
+        positions = self.entries.pop(key, None)
+        if positions is None:
+            self.misses += 1
+            return None
+        self.entries[key] = positions  # most recently used
+        self.hits += 1
+        return positions
+
+    def put(self, key, positions):
+        """
+        :param key: canonical key
+        :param positions: positions of the feasible groups in the canonical form
+        """
+        self.entries[key] = positions
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        """
+        :return: ratio of lookups answered by the cache
+        """
+        return self.hits / float(max(self.hits + self.misses, 1))
+
+    def summary(self):
+        """
+        Summary of the counters.
+        :return: a dictionary
+        """
+        return {'entries': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate()}
+
+
 def check_draw_validity(draw, clubs, associations, paired_clubs, clubs_per_pot, number_of_pots,
-                        groups_in_first_timetable, groups_in_second_timetable):
+                        groups_in_first_timetable, groups_in_second_timetable, constraints=None):
     """
     Check whether or not the draw satisfies all the constraints about
     TV timetables and same association clubs.
@@ -223,33 +328,89 @@ def check_draw_validity(draw, clubs, associations, paired_clubs, clubs_per_pot,
     :param number_of_pots: number of pots in the draw
     :param groups_in_first_timetable: first list of groups playing the same day
     :param groups_in_second_timetable: second list of groups playing the same day
+    :param constraints: GroupStageConstraints instance (built from the previous arguments if None)
     :return: a boolean
     """
+    if constraints is None:
+        constraints = GroupStageConstraints(associations, paired_clubs, clubs_per_pot,
+                                            groups_in_first_timetable, groups_in_second_timetable)
+    valid, tv_failures, association_failures = constraints.is_valid_draw(draw)
     # Checking TV constraints
-    for c1, c2 in paired_clubs.items():
+    if len(tv_failures) > 0:
+        c1 = tv_failures[0]
+        c2 = paired_clubs[c1]
         g1, _ = np.where(draw == c1)
-        g2, _ = np.where(draw == c2)
-        if are_groups_in_same_timetable(g1[0], g2[0], groups_in_first_timetable, groups_in_second_timetable):
-            timetable = '19h' if is_group_in_timetable(g1[0], groups_in_first_timetable, groups_in_second_timetable) \
-                              else '21h'
-            print("Teams %s, %s must be in different timetables, but they are in %s side" % (clubs[c1],
-                                                                                             clubs[c2],
-                                                                                             timetable))
-            return False
+        timetable = '19h' if is_group_in_timetable(g1[0], groups_in_first_timetable, groups_in_second_timetable) \
+            else '21h'
+        print("Teams %s, %s must be in different timetables, but they are in %s side" % (clubs[c1],
+                                                                                         clubs[c2],
+                                                                                         timetable))
     # Checking association constraint
-    for group in range(clubs_per_pot):
-        valid = len(set([associations[club] for club in draw[group, :]])) == number_of_pots
-        if not valid:
-            print("Group %s (%s): %s" % (chr(65 + group),
-                                         valid,
-                                         ", ".join([clubs[club] for club in draw[group, :]])))
-            return False
-    return True
+    elif len(association_failures) > 0:
+        group = association_failures[0]
+        print("Group %s (%s): %s" % (chr(65 + group),
+                                     valid,
+                                     ", ".join([clubs[club] for club in draw[group, :]])))
+    return valid
+
+
+def check_draw_dtype(dtype, number_of_clubs):
+    """
+    Check that the integer type can store every club index and the -1 used for empty positions.
+    :param dtype: integer type of an array of draws
+    :param number_of_clubs: number of clubs in the draw
+    """
+    if not np.issubdtype(dtype, np.signedinteger) or np.iinfo(dtype).max < number_of_clubs - 1:
+        raise ValueError("dtype %s cannot store the indexes of %d clubs" % (np.dtype(dtype), number_of_clubs))
+
+
+class DrawStatistics:
+    """
+    Counters filled by simulate_draw:
+        - attempts: draws started, including those restarted
+        - dead_ends: draws restarted because a club had no feasible group
+        - invalid_draws: complete draws rejected by check_draw_validity
+        - matching_calls: dead-end checks solved by bipartite matching
+        - completion_checks: partial draws checked by the completion oracle (full lookahead)
+        - pot_times: seconds spent drawing each pot
+    """
+    def __init__(self, number_of_pots):
+        self.attempts = 0
+        self.dead_ends = 0
+        self.invalid_draws = 0
+        self.matching_calls = 0
+        self.completion_checks = 0
+        self.pot_times = [0.0] * number_of_pots
+        self.pot_draws = [0] * number_of_pots
+
+    def rejections(self):
+        """
+        Number of draws thrown away.
+        :return: an integer
+        """
+        return self.dead_ends + self.invalid_draws
+
+    def time_per_pot(self):
+        """
+        Average time spent drawing each pot.
+        :return: a list of seconds
+        """
+        return [seconds / draws if draws > 0 else 0.0 for seconds, draws in zip(self.pot_times, self.pot_draws)]
+
+    def summary(self):
+        """
+        Summary of the counters.
+        :return: a dictionary
+        """
+        return {'attempts': self.attempts, 'rejections': self.rejections(), 'dead_ends': self.dead_ends,
+                'invalid_draws': self.invalid_draws, 'matching_calls': self.matching_calls,
+                'completion_checks': self.completion_checks, 'time_per_pot': self.time_per_pot()}
 
 
 def simulate_draw(simulations, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
                   paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
-                  verbose=False, show_errors=True):
+                  verbose=False, show_errors=True, random_state=None, dtype=int, constraints=None,
+                  full_lookahead=False, statistics=None, accumulator=None, first_pot_orders=None, cache=None):
     """
     Simulate the number of draw required.
     :param simulations: The number of draws to be simulated
@@ -262,48 +423,214 @@ def simulate_draw(simulations, clubs, clubs_per_pot, number_of_pots, club_pots,
     :param groups_in_first_timetable: first list of groups playing the same day
     :param groups_in_second_timetable: second list of groups playing the same day
     :param verbose: Trace the draw development printing pot compositions and clubs drawn
-    :param show_errors: Print an error message where a club doesn't have any feasible group
+    :param show_errors: Print an error message where a club doesn't have any feasible group or a draw is not valid
+    :param random_state: numpy RandomState used to draw clubs and groups (numpy global state if None)
+    :param dtype: integer type of the array of draws (np.int8 is enough for up to 127 clubs)
+    :param constraints: GroupStageConstraints instance (built from the previous arguments if None)
+    :param full_lookahead: a group is feasible only if the whole draw can still be completed, not only the pot,
+                           so no draw is ever restarted (ValueError if the draw cannot be completed at all)
+    :param statistics: DrawStatistics instance updated with the counters of the simulation
+    :param accumulator: ConditionalSameGroupAccumulator instance updated with the conditional probabilities
+                        of each assignment of the accepted draws
+    :param first_pot_orders: [simulations]x[clubs in the first pot] array with the order in which the clubs
+                             of the first pot are drawn in each simulation (drawn at random if None).
+                             It requires full_lookahead, a restarted draw would reuse the same order
+    :param cache: FeasibleGroupsCache instance of the tournament, which can be shared by several calls
     :return: a [simulations]x[clubs_per_pot]x[number_of_pots] numpy 3D-array containing club indexes
     """
-    draws = np.full((simulations, clubs_per_pot, number_of_pots), -1)
+    check_draw_dtype(dtype, len(clubs))
+    if first_pot_orders is not None and not full_lookahead:
+        raise ValueError("first_pot_orders requires full_lookahead, a restarted draw would reuse the same order")
+    rng = np.random if random_state is None else random_state
+    if constraints is None:
+        constraints = GroupStageConstraints(associations, paired_clubs, clubs_per_pot,
+                                            groups_in_first_timetable, groups_in_second_timetable)
+    pots = [[idx for idx, pot in enumerate(club_pots) if pot == pot_idx+1] for pot_idx in range(number_of_pots)]
+    engine = build_group_stage_engine(clubs_per_pot, club_pots, associations, paired_clubs,
+                                      groups_in_first_timetable, groups_in_second_timetable)
+    oracle = None
+    if full_lookahead:
+        oracle = CompletionOracle(constraints, pots)
+        if not oracle.can_complete(np.full(len(clubs), -1, dtype=int)):
+            raise ValueError("The draw cannot be completed satisfying every constraint")
+    draws = np.full((simulations, clubs_per_pot, number_of_pots), -1, dtype=dtype)
     simulation = 0
     while simulation < simulations:
         feasible = True
         draws[simulation] = np.full((clubs_per_pot, number_of_pots), -1)
         draw = draws[simulation]
+        engine.reset()
+        if statistics is not None:
+            statistics.attempts += 1
+        if accumulator is not None:
+            accumulator.start_draw()
         for pot_idx in range(number_of_pots):
-            clubs_in_pot = [idx for idx, pot in enumerate(club_pots) if pot == pot_idx+1]
+            start = time.time()
+            clubs_in_pot = list(pots[pot_idx])
             if verbose:
                 print("\nPot #%d:%s" % (pot_idx+1, ', '.join([clubs[idx] for idx in clubs_in_pot])))
-            groups_available = range(clubs_per_pot)
+            groups_available = list(range(clubs_per_pot))
+            engine.start_pot(clubs_in_pot)
             while len(clubs_in_pot) > 0:
-                drawn_club = np.random.choice(clubs_in_pot)
+                if pot_idx == 0 and first_pot_orders is not None:
+                    drawn_club = first_pot_orders[simulation][len(pots[0]) - len(clubs_in_pot)]
+                else:
+                    drawn_club = rng.choice(clubs_in_pot)
                 clubs_in_pot.remove(drawn_club)
+                engine.remove_team(drawn_club)
                 feasible_groups = get_feasible_groups(draw, drawn_club, clubs_in_pot, groups_available,
                                                       pot_idx, associations, paired_clubs,
-                                                      groups_in_first_timetable, groups_in_second_timetable)
+                                                      groups_in_first_timetable, groups_in_second_timetable,
+                                                      engine=engine, cache=cache)
+                if oracle is not None:
+                    feasible_groups = [group for group in feasible_groups
+                                       if can_complete_draw(engine, drawn_club, group, oracle)]
                 if len(feasible_groups) == 0:
                     if show_errors:
                         print("Not group available for club: %s, %s" % (clubs[drawn_club],
                                                                         groups_available))
                     feasible = False
                     break
-                assigned_group = np.random.choice(feasible_groups)  # feasible_groups[0]
+                if accumulator is not None:
+                    accumulator.record(drawn_club, feasible_groups, draw, pot_idx)
+                assigned_group = rng.choice(feasible_groups)  # feasible_groups[0]
                 groups_available.remove(assigned_group)
                 if verbose:
                     print("\t -> %s to group %d\t%s" % (clubs[drawn_club],
                                                         assigned_group,
                                                         feasible_groups))
                 draw[assigned_group, pot_idx] = drawn_club
+                engine.assign(drawn_club, int(assigned_group))
+            if statistics is not None:
+                statistics.pot_times[pot_idx] += time.time() - start
+                statistics.pot_draws[pot_idx] += 1
             if not feasible:
                 break
-        if feasible and check_draw_validity(draw, clubs, associations, paired_clubs, clubs_per_pot, number_of_pots,
-                                            groups_in_first_timetable, groups_in_second_timetable):
+        if statistics is not None:
+            statistics.matching_calls += engine.matching_calls
+        if not feasible:
+            if statistics is not None:
+                statistics.dead_ends += 1
+        elif (check_draw_validity(draw, clubs, associations, paired_clubs, clubs_per_pot, number_of_pots,
+                                  groups_in_first_timetable, groups_in_second_timetable, constraints)
+              if show_errors else constraints.is_valid_draw(draw)[0]):
+            if accumulator is not None:
+                accumulator.accept_draw()
             simulation += 1
+        elif statistics is not None:
+            statistics.invalid_draws += 1
+    if statistics is not None and oracle is not None:
+        statistics.completion_checks += oracle.calls
     return draws
 
 
-def estimate_probabilities(draws, clubs, club_pots):
+def can_complete_draw(engine, drawn_club, group, oracle):
+    """
+    Check whether the draw can be completed after assigning the drawn club to the group.
+    :param engine: group stage DrawEngine instance, the drawn club must have been removed from its remaining teams
+    :param drawn_club: index of the drawn club
+    :param group: candidate group
+    :param oracle: CompletionOracle instance
+    :return: a boolean
+    """
+    engine.assign(drawn_club, group)
+    try:
+        return oracle.can_complete(engine.team_groups)
+    finally:
+        engine.unassign(drawn_club)
+
+
+# Shared buffer storing the draws simulated by the worker processes
+_shared_draws = None
+
+
+def _init_draw_worker(shared_draws):
+    """
+    Initializer for the worker processes: keep a reference to the shared buffer of draws.
+    :param shared_draws: multiprocessing.RawArray storing the flattened draws
+    """
+    global _shared_draws
+    _shared_draws = shared_draws
+
+
+def _simulate_block(block):
+    """
+    Simulate a block of draws and store them into its slice of the shared buffer.
+    :param block: tuple (first simulation index, number of simulations, random state, simulate_draw arguments)
+    :return: the first simulation index of the block
+    """
+    start, size, random_state, args = block
+    draws = simulate_draw(size, *args, verbose=False, show_errors=False, random_state=random_state)
+    shared_draws = np.ctypeslib.as_array(_shared_draws).reshape((-1,) + draws.shape[1:])
+    shared_draws[start:start + size] = draws
+    return start
+
+
+def simulate_draw_in_parallel(simulations, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                              paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                              seed=None, processes=None, block_size=1000, dtype=int):
+    """
+    Simulate the number of draw required sharding the simulations across a pool of processes.
+    Simulations are split into blocks of block_size draws and each block gets its own random state
+    spawned from seed, so the result for a fixed seed is the same whatever the number of processes.
+    :param simulations: The number of draws to be simulated
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param seed: root seed from which the random states of the blocks are spawned (random if None)
+    :param processes: number of worker processes (number of CPUs if None, no pool if 1)
+    :param block_size: number of draws simulated with the same random state
+    :param dtype: integer type of the array of draws (np.int8 is enough for up to 127 clubs)
+    :return: a [simulations]x[clubs_per_pot]x[number_of_pots] numpy 3D-array containing club indexes
+    """
+    args = (clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+            paired_clubs, groups_in_first_timetable, groups_in_second_timetable)
+    starts = list(range(0, simulations, block_size))
+    random_states = spawn_random_states(seed, len(starts))
+    blocks = [(start, min(block_size, simulations - start), random_state, args)
+              for start, random_state in zip(starts, random_states)]
+    check_draw_dtype(dtype, len(clubs))
+    shared_draws = multiprocessing.RawArray(np.ctypeslib.as_ctypes_type(np.dtype(dtype)),
+                                            simulations * clubs_per_pot * number_of_pots)
+    if processes == 1:
+        _init_draw_worker(shared_draws)
+        for block in blocks:
+            _simulate_block(block)
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_draw_worker, initargs=(shared_draws,))
+        try:
+            pool.map(_simulate_block, blocks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return np.ctypeslib.as_array(shared_draws).reshape((simulations, clubs_per_pot, number_of_pots))
+
+
+def count_clubs_in_same_group(draws, number_of_clubs, chunk_size=10000):
+    """
+    Count, for each pair of clubs, the number of draws in which both clubs belong to the same group.
+    Every pair of positions of each group is coded as a single integer and counted with np.bincount,
+    processing the draws in chunks to keep memory bounded.
+    :param draws: [simulations]x[clubs_per_pot]x[number_of_pots] numpy 3D-array
+                  containing the simulated draws (memory-mapped arrays are also accepted)
+    :param number_of_clubs: number of clubs in the draw
+    :param chunk_size: number of draws processed at once
+    :return: a [clubs]x[clubs] numpy 2D-array of integers
+    """
+    counts = np.zeros(number_of_clubs * number_of_clubs, dtype=np.int64)
+    for start in range(0, draws.shape[0], chunk_size):
+        groups = np.asarray(draws[start:start + chunk_size], dtype=np.int64)
+        pairs = groups[:, :, :, np.newaxis] * number_of_clubs + groups[:, :, np.newaxis, :]
+        counts += np.bincount(pairs.ravel(), minlength=number_of_clubs * number_of_clubs)
+    return counts.reshape((number_of_clubs, number_of_clubs))
+
+
+def estimate_probabilities(draws, clubs, club_pots, chunk_size=10000):
     """
     Using all the simulated draws, the probabilities of each pair of club
     to be in the same group are estimated.
@@ -312,21 +639,522 @@ def estimate_probabilities(draws, clubs, club_pots):
                    containing the simulated draws
     :param clubs: list of clubs ordered by association and UEFA ranking
     :param club_pots: pot number of each club
+    :param chunk_size: number of draws processed at once, to handle arrays of draws bigger than memory
     :return: a 48x48 numpy 2D-array containing the probability for each pair of clubs
              belonging to the same group
     """
-    simulations = draws.shape[0]
-    total_events = float(simulations)  # total number of events
-    estimations = np.full((len(clubs), len(clubs)), 0,  dtype=np.float32)  # probability estimations
-
-    # For each pair of teams, calculate the probability of belonging to the same group
-    for club in range(len(clubs)):
-        pot = club_pots[club]-1  # Pot to which the current team belongs
-        rivals = np.array([draws[i, np.where(draws[i, :, :] == club)[0][0], :] for i in range(simulations)])
-        estimations[club, club] = 1  # each team has a prob=1 of belonging to its own group
-        rivals = rivals.flatten()
-        counts = collections.Counter(rivals)
-        for rival, counter in counts.items():
-            estimations[club, rival] = float(counter)/total_events
-
-    return estimations
+    total_events = float(draws.shape[0])  # total number of events
+    counts = count_clubs_in_same_group(draws, len(clubs), chunk_size)
+    return (counts / total_events).astype(np.float32)
+
+
+class SameGroupAccumulator:
+    """
+    Running accumulator of the number of draws in which each pair of clubs belong to the same group.
+    Each pair is a Bernoulli event per draw, so the variance of the estimated probabilities, and hence
+    their standard errors, are derived from the same counts and memory does not grow with the simulations.
+    """
+    def __init__(self, number_of_clubs):
+        self.number_of_clubs = number_of_clubs
+        self.simulations = 0
+        self.counts = np.zeros((number_of_clubs, number_of_clubs), dtype=np.int64)
+
+    def update(self, draws):
+        """
+        Fold a batch of draws into the accumulator.
+        :param draws: [simulations]x[clubs_per_pot]x[number_of_pots] numpy 3D-array
+        """
+        self.counts += count_clubs_in_same_group(draws, self.number_of_clubs)
+        self.simulations += draws.shape[0]
+
+    def probabilities(self):
+        """
+        :return: a [clubs]x[clubs] numpy 2D-array containing the estimated probabilities
+        """
+        return self.counts / float(max(self.simulations, 1))
+
+    def standard_errors(self):
+        """
+        :return: a [clubs]x[clubs] numpy 2D-array containing the standard error of each estimated probability
+        """
+        probabilities = self.probabilities()
+        return np.sqrt(probabilities * (1 - probabilities) / max(self.simulations, 1))
+
+    def confidence_intervals(self, z=1.96):
+        """
+        :param z: quantile of the normal distribution (1.96 for a 95% confidence level)
+        :return: a tuple of [clubs]x[clubs] numpy 2D-arrays with the lower and upper bounds
+        """
+        probabilities = self.probabilities()
+        margin = z * self.standard_errors()
+        return np.clip(probabilities - margin, 0, 1), np.clip(probabilities + margin, 0, 1)
+
+
+class ConditionalSameGroupAccumulator:
+    """
+    Rao-Blackwellized accumulator of the probabilities of each pair of clubs to be in the same group.
+    Instead of the outcome of each draw, it records the exact probability, conditioned on the partial draw,
+    that the drawn club joins each club already drawn: 1/[feasible groups] for the clubs of every feasible group.
+    Every pair of clubs from different pots is decided at exactly one assignment, so the mean of these
+    conditional probabilities is an unbiased estimate whose variance is never larger than that of the counts.
+    It is exact when draws are not restarted (full lookahead, or draws without dead ends).
+    Draws can be split into strata with known weights, e.g. sets of orders of the first pot.
+    """
+    def __init__(self, number_of_clubs, stratum_weights=None):
+        self.number_of_clubs = number_of_clubs
+        self.stratum_weights = np.array([1.0] if stratum_weights is None else stratum_weights, dtype=np.float64)
+        self.stratum = 0
+        self.simulations = np.zeros(len(self.stratum_weights), dtype=np.int64)
+        self.sums = np.zeros((len(self.stratum_weights), number_of_clubs * number_of_clubs), dtype=np.float64)
+        self.squares = np.zeros((len(self.stratum_weights), number_of_clubs * number_of_clubs), dtype=np.float64)
+        self.pending = []
+
+    def start_draw(self):
+        """
+        Discard the conditional probabilities of the previous attempt if it was not accepted.
+        """
+        self.pending = []
+
+    def record(self, drawn_club, feasible_groups, draw, pot_idx):
+        """
+        Record the conditional probabilities of an assignment.
+        :param drawn_club: index of the drawn club
+        :param feasible_groups: groups among which the club is assigned uniformly
+        :param draw: [clubs_per_pot]x[number_of_pots] numpy 2D-array with the partial draw
+        :param pot_idx: index of the pot of the drawn club
+        """
+        if pot_idx > 0:
+            rivals = draw[feasible_groups, :pot_idx].ravel()
+            self.pending.append((drawn_club, rivals[rivals > -1], 1.0 / len(feasible_groups)))
+
+    def accept_draw(self):
+        """
+        Fold the conditional probabilities of the current draw into its stratum.
+        """
+        if self.pending:
+            clubs = np.concatenate([np.full(len(step[1]), step[0], dtype=np.int64) for step in self.pending])
+            rivals = np.concatenate([step[1] for step in self.pending]).astype(np.int64)
+            probabilities = np.concatenate([np.full(len(step[1]), step[2]) for step in self.pending])
+            pairs = np.concatenate([clubs * self.number_of_clubs + rivals, rivals * self.number_of_clubs + clubs])
+            probabilities = np.concatenate([probabilities, probabilities])
+            size = self.number_of_clubs * self.number_of_clubs
+            self.sums[self.stratum] += np.bincount(pairs, weights=probabilities, minlength=size)
+            self.squares[self.stratum] += np.bincount(pairs, weights=probabilities ** 2, minlength=size)
+        self.simulations[self.stratum] += 1
+        self.pending = []
+
+    def probabilities(self):
+        """
+        :return: a [clubs]x[clubs] numpy 2D-array containing the estimated probabilities
+        """
+        means = self.sums / np.maximum(self.simulations, 1)[:, np.newaxis]
+        probabilities = np.dot(self.stratum_weights, means).reshape((self.number_of_clubs, self.number_of_clubs))
+        np.fill_diagonal(probabilities, 1.0)
+        return probabilities
+
+    def standard_errors(self):
+        """
+        Standard errors from the variance within each stratum (at least two draws per stratum are required).
+        :return: a [clubs]x[clubs] numpy 2D-array containing the standard error of each estimated probability
+        """
+        simulations = np.maximum(self.simulations, 2)[:, np.newaxis].astype(np.float64)
+        variances = np.maximum(self.squares - self.sums ** 2 / simulations, 0) / (simulations - 1)
+        errors = np.sqrt(np.dot(self.stratum_weights ** 2, variances / simulations))
+        return errors.reshape((self.number_of_clubs, self.number_of_clubs))
+
+
+def simulate_draw_in_batches(batch_size, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                             paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                             simulations=None, seed=None, dtype=int):
+    """
+    Generate simulated draws in batches, so the whole array of draws is never materialized.
+    Each batch uses the random state spawned from seed for its index, so batches are the same
+    as the blocks of simulate_draw_in_parallel with block_size=batch_size.
+    :param batch_size: number of draws in each batch
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param simulations: total number of draws to be simulated (endless generator if None)
+    :param seed: root seed from which the random states of the batches are spawned (random if None)
+    :param dtype: integer type of the arrays of draws (np.int8 is enough for up to 127 clubs)
+    :return: a generator of [batch_size]x[clubs_per_pot]x[number_of_pots] numpy 3D-arrays
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    args = (clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+            paired_clubs, groups_in_first_timetable, groups_in_second_timetable)
+    batch = 0
+    while simulations is None or batch * batch_size < simulations:
+        size = batch_size if simulations is None else min(batch_size, simulations - batch * batch_size)
+        yield simulate_draw(size, *args, verbose=False, show_errors=False,
+                            random_state=spawn_random_state(seed, batch), dtype=dtype)
+        batch += 1
+
+
+def estimate_probabilities_online(clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                                  paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                                  max_standard_error=0.001, max_simulations=1000000, batch_size=1000, seed=None):
+    """
+    Estimate the probabilities of each pair of clubs to be in the same group folding batches of
+    simulated draws into a SameGroupAccumulator, and stop as soon as every probability
+    has a standard error lower than max_standard_error.
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param max_standard_error: stopping rule for the standard error of every probability (as a ratio)
+    :param max_simulations: maximum number of draws to be simulated
+    :param batch_size: number of draws simulated between two checks of the stopping rule
+    :param seed: root seed from which the random states of the batches are spawned (random if None)
+    :return: the SameGroupAccumulator with the counts of all the simulated draws
+    """
+    accumulator = SameGroupAccumulator(len(clubs))
+    for draws in simulate_draw_in_batches(batch_size, clubs, clubs_per_pot, number_of_pots, club_pots,
+                                          associations, paired_clubs, groups_in_first_timetable,
+                                          groups_in_second_timetable, max_simulations, seed):
+        accumulator.update(draws)
+        if accumulator.standard_errors().max() < max_standard_error:
+            break
+    return accumulator
+
+
+def estimate_probabilities_rao_blackwell(simulations, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                                         paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                                         strata=None, seed=None, full_lookahead=None):
+    """
+    Estimate the probabilities of each pair of clubs to be in the same group with the conditional
+    probabilities of the assignments of simulate_draw (see ConditionalSameGroupAccumulator), which need
+    far fewer draws than counting outcomes for the same standard errors.
+    With strata, the orders of the first pot are split into that number of blocks of consecutive
+    lexicographic ranks, and the same number of draws is simulated with orders taken uniformly from each block.
+    :param simulations: The number of draws to be simulated
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param strata: number of strata of the orders of the first pot (no stratification if None)
+    :param seed: root seed from which the random states of the strata are spawned (random if None)
+    :param full_lookahead: never restart a draw, so the estimates are unbiased whatever the constraints.
+                           A restarted draw would keep the order of the first pot taken from its stratum,
+                           so it is required with strata (True if None with strata, False if None without them)
+    :return: the ConditionalSameGroupAccumulator with the conditional probabilities of all the simulated draws
+    """
+    if full_lookahead is None:
+        full_lookahead = strata is not None
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    args = (clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+            paired_clubs, groups_in_first_timetable, groups_in_second_timetable)
+    constraints = GroupStageConstraints(associations, paired_clubs, clubs_per_pot,
+                                        groups_in_first_timetable, groups_in_second_timetable)
+    if strata is None:
+        accumulator = ConditionalSameGroupAccumulator(len(clubs))
+        simulate_draw(simulations, *args, show_errors=False, random_state=spawn_random_state(seed, 0),
+                      constraints=constraints, full_lookahead=full_lookahead, accumulator=accumulator)
+        return accumulator
+    first_pot = [idx for idx, pot in enumerate(club_pots) if pot == 1]
+    orders = math.factorial(len(first_pot))
+    if not full_lookahead:
+        raise ValueError("Strata require full_lookahead, a restarted draw would reuse the same order")
+    if strata > orders or simulations < 2 * strata:
+        raise ValueError("%d strata need at most %d orders and at least %d simulations"
+                         % (strata, orders, 2 * strata))
+    bounds = [stratum * orders // strata for stratum in range(strata + 1)]
+    accumulator = ConditionalSameGroupAccumulator(len(clubs), [(bounds[stratum + 1] - bounds[stratum]) / float(orders)
+                                                               for stratum in range(strata)])
+    for stratum in range(strata):
+        size = simulations // strata + (1 if stratum < simulations % strata else 0)
+        random_state = spawn_random_state(seed, stratum)
+        ranks = [bounds[stratum] + int(random_state.random_sample() * (bounds[stratum + 1] - bounds[stratum]))
+                 for _ in range(size)]
+        accumulator.stratum = stratum
+        simulate_draw(size, *args, show_errors=False, random_state=random_state, constraints=constraints,
+                      full_lookahead=full_lookahead, accumulator=accumulator,
+                      first_pot_orders=[unrank_permutation(first_pot, rank) for rank in ranks])
+    return accumulator
+
+
+def get_canonical_draw_key(club_groups, constraints):
+    """
+    Build a canonical key for a partial draw. Groups belonging to the same timetable are
+    interchangeable for the rest of the draw and for the probabilities of each pair of clubs
+    to be in the same group, so the key is the sorted list of group compositions of each timetable.
+    :param club_groups: group of each club or -1 for the clubs not drawn yet
+    :param constraints: GroupStageConstraints instance
+    :return: a hashable tuple
+    """
+    compositions = [[] for _ in range(constraints.number_of_groups)]
+    for club, group in enumerate(club_groups):
+        if group > -1:
+            compositions[group].append(club)
+    return tuple(tuple(sorted(tuple(compositions[group]) for group in np.where(constraints.timetables == timetable)[0]))
+                 for timetable in (-1, 0, 1))
+
+
+def calculate_exact_probabilities(clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                                  paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                                  max_states=1000000, return_number_of_states=False):
+    """
+    Calculate the exact probabilities of each pair of clubs to be in the same group
+    following the procedure of simulate_draw as a Markov process: a club is drawn uniformly
+    from its pot and then assigned uniformly to one of its feasible groups. Draws reaching a dead end
+    are restarted in simulate_draw, so probabilities are conditioned to not reaching any dead end.
+    The probability of every partial draw is propagated club by club, merging the partial draws
+    sharing the same canonical key.
+    Just reduced configurations are covered: the partial draws grow factorially with the pots even after merging
+    interchangeable groups, so the full Champions League and Europa League draws (32 and 48 clubs) exceed
+    max_states and raise ValueError. It is meant to validate the simulations on a few pots or groups.
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param max_states: maximum number of partial draws kept at the same time
+    :param return_number_of_states: return also the number of distinct partial draws visited
+    :return: a [clubs]x[clubs] numpy 2D-array containing the probability for each pair of clubs
+             belonging to the same group (and the number of states if return_number_of_states)
+    """
+    constraints = GroupStageConstraints(associations, paired_clubs, clubs_per_pot,
+                                        groups_in_first_timetable, groups_in_second_timetable)
+    initial_state = tuple([-1] * len(clubs))
+    states = {get_canonical_draw_key(initial_state, constraints): [initial_state, 1.0]}
+    number_of_states = 1
+    for pot_idx in range(number_of_pots):
+        clubs_in_pot = [idx for idx, pot in enumerate(club_pots) if pot == pot_idx+1]
+        for _ in clubs_in_pot:
+            next_states = {}
+            for state, probability in states.values():
+                club_groups = np.array(state)
+                remaining_clubs = [c for c in clubs_in_pot if club_groups[c] == -1]
+                groups_available = sorted(set(range(clubs_per_pot)) - set(club_groups[clubs_in_pot]))
+                for drawn_club in remaining_clubs:
+                    clubs_after_draw = copy_list_and_remove_element(drawn_club, remaining_clubs)
+                    # The draw itself is not required once the constraint model and club_groups are given
+                    feasible_groups = get_feasible_groups(None, drawn_club, clubs_after_draw, groups_available,
+                                                          pot_idx, associations, paired_clubs,
+                                                          groups_in_first_timetable, groups_in_second_timetable,
+                                                          constraints, club_groups)
+                    for group in feasible_groups:
+                        club_groups[drawn_club] = group
+                        key = get_canonical_draw_key(club_groups, constraints)
+                        transition = probability / (len(remaining_clubs) * len(feasible_groups))
+                        if key in next_states:
+                            next_states[key][1] += transition
+                        else:
+                            next_states[key] = [tuple(club_groups), transition]
+                    club_groups[drawn_club] = -1
+            if len(next_states) > max_states:
+                raise ValueError("The draw has more than %d partial draws at the same step, "
+                                 "use a reduced configuration" % max_states)
+            states = next_states
+            number_of_states += len(states)
+
+    probabilities = np.zeros((len(clubs), len(clubs)), dtype=np.float64)
+    for state, probability in states.values():
+        club_groups = np.array(state)
+        same_group = club_groups[:, np.newaxis] == club_groups[np.newaxis, :]
+        probabilities += probability * same_group
+    probabilities /= probabilities[0, 0]  # probability of finishing the draw without dead ends
+    if return_number_of_states:
+        return probabilities, number_of_states
+    return probabilities
+
+
+class UniformDrawSampler:
+    """
+    Uniform sampling of the group stage draws satisfying the TV constraints.
+    Each pot is split between both timetables first: the number of splits of the following pots only depends
+    on how many of their clubs are forced into each timetable by their paired clubs, so the splits are counted
+    by memoized recursion on these numbers and sampled with probability proportional to their completions.
+    Then the clubs of each timetable are placed in a random permutation of its groups.
+    """
+    def __init__(self, clubs_per_pot, number_of_pots, club_pots, paired_clubs,
+                 groups_in_first_timetable, groups_in_second_timetable):
+        for pot_idx in range(number_of_pots):
+            if list(club_pots).count(pot_idx + 1) != clubs_per_pot:
+                raise ValueError("Pot %d must have %d clubs" % (pot_idx + 1, clubs_per_pot))
+        if len(paired_clubs) == 0:
+            groups_in_first_timetable, groups_in_second_timetable = list(range(clubs_per_pot)), []
+        elif sorted(list(groups_in_first_timetable) + list(groups_in_second_timetable)) != list(range(clubs_per_pot)):
+            raise ValueError("Every group must belong to exactly one timetable")
+        self.clubs_per_pot = clubs_per_pot
+        self.number_of_pots = number_of_pots
+        self.paired_clubs = paired_clubs
+        self.groups_in_timetables = (list(groups_in_first_timetable), list(groups_in_second_timetable))
+        self.pots = [[idx for idx, pot in enumerate(club_pots) if pot == pot_idx + 1]
+                     for pot_idx in range(number_of_pots)]
+        self.pot_pairings = []
+        for pot_idx in range(number_of_pots):
+            forced, pairs, later, unpaired = [], [], dict((pot, []) for pot in range(pot_idx + 1, number_of_pots)), []
+            for club in self.pots[pot_idx]:
+                paired_club = paired_clubs.get(club)
+                paired_pot = None if paired_club is None else club_pots[paired_club] - 1
+                if paired_club is None:
+                    unpaired.append(club)
+                elif paired_pot < pot_idx:
+                    forced.append(club)
+                elif paired_pot > pot_idx:
+                    later[paired_pot].append(club)
+                elif club < paired_club:
+                    pairs.append((club, paired_club))
+            self.pot_pairings.append((forced, pairs, later, unpaired))
+        self.splits = {}
+        self.completions = {}
+
+    def get_splits(self, pot_idx, state):
+        """
+        Possible splits of a pot between both timetables.
+        :param pot_idx: pot index
+        :param state: tuple with the number of clubs of each pot forced into the second timetable
+        :return: a list of tuples (number of ways, dictionary with the number of clubs paired with each later pot
+                 going to the first timetable, number of unpaired clubs going to the first timetable, next state)
+        """
+        key = (pot_idx, state)
+        if key not in self.splits:
+            forced, pairs, later, unpaired = self.pot_pairings[pot_idx]
+            pending = len(self.groups_in_timetables[0]) - (len(forced) - state[pot_idx]) - len(pairs)
+            later_pots = sorted(later)
+            splits = []
+            for numbers in itertools.product(*[range(len(later[pot]) + 1) for pot in later_pots]):
+                unpaired_in_first = pending - sum(numbers)
+                ways = 2**len(pairs) * binomial_coefficient(len(unpaired), unpaired_in_first)
+                for pot, number in zip(later_pots, numbers):
+                    ways *= binomial_coefficient(len(later[pot]), number)
+                if ways > 0:
+                    next_state = list(state)
+                    for pot, number in zip(later_pots, numbers):
+                        next_state[pot] += number  # their paired clubs cannot go to the first timetable
+                    splits.append((ways, dict(zip(later_pots, numbers)), unpaired_in_first, tuple(next_state)))
+            self.splits[key] = splits
+        return self.splits[key]
+
+    def count_completions(self, pot_idx, state):
+        """
+        Count the splits between both timetables of the pot and the following ones.
+        :param pot_idx: pot index
+        :param state: tuple with the number of clubs of each pot forced into the second timetable
+        :return: an integer
+        """
+        if pot_idx == self.number_of_pots:
+            return 1
+        key = (pot_idx, state)
+        if key not in self.completions:
+            self.completions[key] = sum([ways * self.count_completions(pot_idx + 1, next_state)
+                                         for ways, _, _, next_state in self.get_splits(pot_idx, state)])
+        return self.completions[key]
+
+    def count_draws(self):
+        """
+        Count the group stage draws satisfying the TV constraints.
+        :return: an integer
+        """
+        permutations = math.factorial(len(self.groups_in_timetables[0])) * \
+            math.factorial(len(self.groups_in_timetables[1]))
+        return self.count_completions(0, (0,) * self.number_of_pots) * permutations**self.number_of_pots
+
+    def sample(self, random_state):
+        """
+        Sample a group stage draw uniformly from the draws satisfying the TV constraints.
+        :param random_state: numpy RandomState
+        :return: a [clubs_per_pot]x[number_of_pots] numpy 2D-array containing club indexes
+        """
+        if self.count_draws() == 0:
+            raise ValueError("There is no draw satisfying the TV constraints")
+        draw = np.full((self.clubs_per_pot, self.number_of_pots), -1, dtype=int)
+        club_timetables = {}
+        state = (0,) * self.number_of_pots
+        for pot_idx, (forced, pairs, later, unpaired) in enumerate(self.pot_pairings):
+            splits = self.get_splits(pot_idx, state)
+            weights = np.cumsum([float(ways * self.count_completions(pot_idx + 1, next_state))
+                                 for ways, _, _, next_state in splits])
+            _, later_in_first, unpaired_in_first, state = \
+                splits[min(np.searchsorted(weights, random_state.random_sample() * weights[-1], side='right'),
+                           len(splits) - 1)]
+            for club in forced:
+                club_timetables[club] = 1 - club_timetables[self.paired_clubs[club]]
+            for club, paired_club in pairs:
+                club_timetables[club] = random_state.randint(2)
+                club_timetables[paired_club] = 1 - club_timetables[club]
+            for clubs, clubs_in_first in [(later[pot], later_in_first[pot]) for pot in later] + \
+                                         [(unpaired, unpaired_in_first)]:
+                for idx, club in enumerate(random_state.permutation(clubs)):
+                    club_timetables[club] = 0 if idx < clubs_in_first else 1
+            for timetable, groups in enumerate(self.groups_in_timetables):
+                clubs = [club for club in self.pots[pot_idx] if club_timetables[club] == timetable]
+                draw[groups, pot_idx] = random_state.permutation(clubs)
+        return draw
+
+
+def count_timetable_valid_draws(clubs_per_pot, number_of_pots, club_pots, paired_clubs,
+                                groups_in_first_timetable, groups_in_second_timetable):
+    """
+    Count exactly the group stage draws satisfying the TV constraints.
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :return: an integer
+    """
+    return UniformDrawSampler(clubs_per_pot, number_of_pots, club_pots, paired_clubs,
+                              groups_in_first_timetable, groups_in_second_timetable).count_draws()
+
+
+def sample_uniform_draws(samples, clubs, clubs_per_pot, number_of_pots, club_pots, associations,
+                         paired_clubs, groups_in_first_timetable, groups_in_second_timetable,
+                         random_state=None, dtype=int, return_acceptance_rate=False, constraints=None):
+    """
+    Sample group stage draws uniformly from all the valid draws: draws are sampled uniformly
+    from the draws satisfying the TV constraints and rejected if they break the association constraint.
+    The number of valid draws can be estimated as count_timetable_valid_draws times the acceptance rate.
+    :param samples: number of draws to be sampled
+    :param clubs: list of clubs ordered by association and UEFA ranking
+    :param clubs_per_pot: number of clubs in each pot
+    :param number_of_pots: number of pots in the draw
+    :param club_pots: pot number of each club
+    :param associations: association of each club
+    :param paired_clubs: pairs of clubs having opposite timetables
+    :param groups_in_first_timetable: first list of groups playing the same day
+    :param groups_in_second_timetable: second list of groups playing the same day
+    :param random_state: numpy RandomState (numpy global state if None)
+    :param dtype: integer type of the array of draws
+    :param return_acceptance_rate: return also the fraction of sampled draws satisfying the association constraint
+    :param constraints: GroupStageConstraints instance (built from the previous arguments if None)
+    :return: a [samples]x[clubs_per_pot]x[number_of_pots] numpy 3D-array containing club indexes
+             (and the acceptance rate if return_acceptance_rate)
+    """
+    check_draw_dtype(dtype, len(clubs))
+    rng = np.random if random_state is None else random_state
+    if constraints is None:
+        constraints = GroupStageConstraints(associations, paired_clubs, clubs_per_pot,
+                                            groups_in_first_timetable, groups_in_second_timetable)
+    sampler = UniformDrawSampler(clubs_per_pot, number_of_pots, club_pots, paired_clubs,
+                                 groups_in_first_timetable, groups_in_second_timetable)
+    draws = np.full((samples, clubs_per_pot, number_of_pots), -1, dtype=dtype)
+    sample, attempts = 0, 0
+    while sample < samples:
+        draw = sampler.sample(rng)
+        attempts += 1
+        if constraints.is_valid_draw(draw)[0]:
+            draws[sample] = draw
+            sample += 1
+    if return_acceptance_rate:
+        return draws, float(samples) / attempts if attempts > 0 else 1.0
+    return draws
@@ -0,0 +1,248 @@
+import contextlib
+import functools
+import json
+import marshal
+import os
+import sys
+import time
+import types
+import constraints
+import engine
+import group_stage_simulator
+import knockout_stage_simulator
+import world_cup_simulator
+
+# Functions replaced by timed wrappers in their modules while the instrumentation is enabled
+INSTRUMENTED_FUNCTIONS = [
+    (group_stage_simulator, 'get_feasible_groups'),
+    (group_stage_simulator, 'can_complete_draw'),
+    (group_stage_simulator, 'check_draw_validity'),
+    (knockout_stage_simulator, 'calculate_knockout_probabilities'),
+    (knockout_stage_simulator, 'simulate_knockout_draws'),
+    (knockout_stage_simulator, 'count_knockout_completions'),
+    (knockout_stage_simulator, 'sample_uniform_knockout_draws'),
+    (knockout_stage_simulator, 'calculate_uniform_knockout_probabilities'),
+]
+# Matching repairs of the dead-end checks, recorded by calling module (e.g. 'engine.complete_matching')
+INSTRUMENTED_CALL_SITES = [
+    (engine, 'complete_matching'),
+    (knockout_stage_simulator, 'complete_matching'),
+]
+# Methods of the draw engines and the completion oracle used by the simulators
+INSTRUMENTED_METHODS = [
+    (engine.DrawEngine, 'feasible_groups'),
+    (engine.DrawEngine, 'has_no_dead_ends'),
+    (engine.DrawEngine, 'assign'),
+    (engine.DrawEngine, 'unassign'),
+    (world_cup_simulator.VectorizedDrawEngine, 'simulate_batch'),
+    (constraints.CompletionOracle, 'can_complete'),
+]
+# Generators of the knockout probability tree, recorded by depth: (module, name, position of the depth argument)
+INSTRUMENTED_TREES = [
+    (knockout_stage_simulator, 'unfold_fixture_tree', 5),
+]
+
+timer = getattr(time, 'perf_counter', time.time)
+_active_instrumentation = None
+
+
+class Instrumentation:
+    """
+    Call counts and times of the instrumented functions:
+        - calls: number of calls of each function
+        - cumulative_times: seconds spent in each function including the instrumented functions it calls
+        - self_times: seconds spent in each function excluding the instrumented functions it calls
+    Knockout tree expansion is recorded per depth, e.g. 'unfold_fixture_tree[depth=3]'.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.cumulative_times = {}
+        self.self_times = {}
+        self.codes = {}
+        self.stack = []  # time spent in instrumented callees of each active call
+
+    def start(self):
+        self.stack.append(0.0)
+        return timer()
+
+    def stop(self, name, start):
+        elapsed = timer() - start
+        children = self.stack.pop()
+        if self.stack:
+            self.stack[-1] += elapsed
+        self.cumulative_times[name] = self.cumulative_times.get(name, 0.0) + elapsed
+        self.self_times[name] = self.self_times.get(name, 0.0) + elapsed - children
+
+    def count(self, name, function):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if name not in self.codes:
+            code = function.__code__
+            self.codes[name] = (code.co_filename, code.co_firstlineno, name)
+
+    def wrap(self, name, function):
+        """
+        Build a timed wrapper of a function.
+        :param name: name under which the calls are recorded
+        :param function: function to be wrapped
+        :return: a function
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self.count(name, function)
+            start = self.start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.stop(name, start)
+        return wrapper
+
+    def wrap_tree(self, name, function, depth_position):
+        """
+        Build a timed wrapper of a recursive generator recording its calls per depth.
+        Just the time spent producing each item is measured, not the time of the consumer.
+        :param name: name under which the calls are recorded
+        :param function: generator function to be wrapped
+        :param depth_position: position of the depth argument
+        :return: a generator function
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            depth = args[depth_position] if len(args) > depth_position else kwargs.get('depth', 1)
+            depth_name = '%s[depth=%d]' % (name, depth)
+            self.count(depth_name, function)
+            generator = function(*args, **kwargs)
+            while True:
+                start = self.start()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    self.stop(depth_name, start)
+                yield item
+        return wrapper
+
+    def summary(self):
+        """
+        Summary of the recorded calls.
+        :return: a dictionary with function names as keys and dictionaries (calls, cumulative_time, self_time)
+                 as values
+        """
+        return dict((name, {'calls': self.calls[name],
+                            'cumulative_time': self.cumulative_times.get(name, 0.0),
+                            'self_time': self.self_times.get(name, 0.0)}) for name in self.calls)
+
+    def dump_json(self, path):
+        """
+        Write the summary into a JSON file.
+        :param path: path of the file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=1, sort_keys=True)
+
+    def dump_stats(self, path):
+        """
+        Write the recorded calls in the format of cProfile dumps, to be loaded with pstats.Stats(path).
+        :param path: path of the file
+        """
+        stats = dict((self.codes[name], (self.calls[name], self.calls[name], self.self_times.get(name, 0.0),
+                                         self.cumulative_times.get(name, 0.0), {}))
+                     for name in self.calls)
+        with open(path, 'wb') as f:
+            marshal.dump(stats, f)
+
+
+def get_module_copies(module):
+    """
+    Every loaded copy of a module: the same file imported under another name (e.g. draw.group_stage_simulator
+    from the notebooks and group_stage_simulator from the modules of the package) is a different module object.
+    :param module: module
+    :return: a list of modules
+    """
+    path = os.path.splitext(os.path.realpath(module.__file__))[0]
+    copies = []
+    for copy in list(sys.modules.values()):
+        if getattr(copy, '__file__', None) and os.path.splitext(os.path.realpath(copy.__file__))[0] == path \
+                and copy not in copies:
+            copies.append(copy)
+    return copies
+
+
+def enable_instrumentation(namespace=None):
+    """
+    Replace the instrumented functions by timed wrappers in every loaded copy of their modules, so the calls
+    between functions of the package are recorded whatever the name under which it was imported.
+    Names imported before with "from ... import" keep pointing to the original functions unless their
+    namespace is given, e.g. enable_instrumentation(globals()) in a notebook using "from draw.... import *".
+    Nothing is replaced while the instrumentation is disabled, so it has no overhead then.
+    :param namespace: dictionary of names (globals() of a notebook or script) to be rebound to the wrappers
+    :return: an Instrumentation instance collecting the calls until disable_instrumentation is called
+    """
+    global _active_instrumentation
+    if _active_instrumentation is not None:
+        raise ValueError("The instrumentation is already enabled")
+    instrumentation = Instrumentation()
+    originals = []
+    wrappers = {}
+
+    def replace(owner, name, wrapper):
+        function = owner.__dict__[name]
+        originals.append((owner, name, function))
+        wrappers[function] = wrapper(function)
+        setattr(owner, name, wrappers[function])
+
+    for module, name in INSTRUMENTED_FUNCTIONS:
+        for copy in get_module_copies(module):
+            replace(copy, name, lambda function: instrumentation.wrap(name, function))
+    for module, name in INSTRUMENTED_CALL_SITES:
+        for copy in get_module_copies(module):
+            replace(copy, name, lambda function: instrumentation.wrap('%s.%s' % (module.__name__, name), function))
+    for cls, name in INSTRUMENTED_METHODS:
+        for copy in get_module_copies(sys.modules[cls.__module__]):
+            replace(getattr(copy, cls.__name__), name,
+                    lambda function: instrumentation.wrap('%s.%s' % (cls.__name__, name), function))
+    for module, name, depth_position in INSTRUMENTED_TREES:
+        for copy in get_module_copies(module):
+            replace(copy, name, lambda function: instrumentation.wrap_tree(name, function, depth_position))
+    if namespace is not None:
+        for name, value in list(namespace.items()):
+            if isinstance(value, types.FunctionType) and value in wrappers:
+                originals.append((namespace, name, value))
+                namespace[name] = wrappers[value]
+    instrumentation.originals = originals
+    _active_instrumentation = instrumentation
+    return instrumentation
+
+
+def disable_instrumentation():
+    """
+    Restore the original functions.
+    :return: the Instrumentation instance with the calls recorded while enabled
+    """
+    global _active_instrumentation
+    if _active_instrumentation is None:
+        raise ValueError("The instrumentation is not enabled")
+    instrumentation = _active_instrumentation
+    for owner, name, function in reversed(instrumentation.originals):
+        if isinstance(owner, dict):
+            owner[name] = function
+        else:
+            setattr(owner, name, function)
+    _active_instrumentation = None
+    return instrumentation
+
+
+@contextlib.contextmanager
+def instrumented(namespace=None):
+    """
+    Context manager enabling the instrumentation inside a with block:
+        with instrumented(globals()) as instrumentation:
+            simulate_draw(...)
+        instrumentation.dump_json('summary.json')
+    :param namespace: dictionary of names to be rebound to the wrappers (see enable_instrumentation)
+    """
+    instrumentation = enable_instrumentation(namespace)
+    try:
+        yield instrumentation
+    finally:
+        disable_instrumentation()
@@ -1,5 +1,6 @@
-import networkx as nx
 import numpy as np
+from matching import build_adjacency, complete_matching, iterate_bits
+from team import TeamRegistry
 from utils import copy_list_and_remove_element
 
 
@@ -53,22 +54,15 @@ def exist_maximum_matching_for_knockout(remaining_runners, remaining_winners):
     A bipartite graph is built using remaining_runners clubs (first class) and
     remaining_winners clubs (second class). For each club in the first class, eligible clubs
     from the second class are calculated, and for each of these pairs of nodes (1st class, 2nd class)
-    an edge is built. If the maximum matching for this bipartite graph is exactly the sum of
-    the sizes of remaining_runners and remaining_winners, then there is no dead ends yet.
+    an edge is built. If every runner-up can be matched to a different winner (both classes have
+    the same size), then there is no dead ends yet.
     :param remaining_runners: list of Team instances for remaining runner-up clubs
     :param remaining_winners: list of Team instances for remaining winner clubs
     :return: a boolean
     """
-    graph = nx.Graph()
-    size = len(remaining_runners)
-    graph.add_nodes_from(range(size), bipartite=0)
-    graph.add_nodes_from(range(size, 2*size), bipartite=1)
-    for idx, r in enumerate(remaining_runners):
-        for fw in filter_winners(r, remaining_winners):
-            w_idx = remaining_winners.index(fw)
-            graph.add_edge(idx, w_idx + size)
-    max_size = len(nx.algorithms.bipartite.maximum_matching(graph))
-    return max_size == 2 * size
+    adjacency = build_adjacency(remaining_runners, remaining_winners,
+                                lambda r, w: w.group != r.group and w.country != r.country)
+    return complete_matching(adjacency)
 
 
 def unfold_probability_tree(pot1, pot2, pairings, log_probability, depth=1):
@@ -76,6 +70,7 @@ def unfold_probability_tree(pot1, pot2, pairings, log_probability, depth=1):
     Recursively build the full probability tree for the draw taking into account the constraints.
     For perfomance reasons:
     - A generator is used to avoid memory issues.
+    - Teams are handled as integer ids and pots as bitmasks, see unfold_fixture_tree.
     - Bipartite graphs and maximum matching algorithm are used just after the second pairing,
       because Chelsea, being the most constrained club in the draw, has three elegible rivals.
     To avoid accuracy problems logarithmic probability is used as input parameter but a common
@@ -87,27 +82,265 @@ def unfold_probability_tree(pot1, pot2, pairings, log_probability, depth=1):
     :param depth: counter for the tree depth
     :return: a generator returning valid branches for the knockout draw
     """
-    if len(pot1) == 0 or len(pot2) == 0:
-        yield (pairings, np.exp(log_probability))
+    eligible_winners = build_eligible_winners(pot1, pot2)
+    for fixtures, probability in unfold_fixture_tree((1 << len(pot1)) - 1, (1 << len(pot2)) - 1, eligible_winners,
+                                                     (), log_probability, depth):
+        new_pairings = pairings.copy()
+        for runner_up, winner in fixtures:
+            new_pairings[pot1[runner_up]] = pot2[winner]
+        yield (new_pairings, probability)
+
+
+def unfold_fixture_tree(runners_mask, winners_mask, eligible_winners, fixtures, log_probability, depth=1):
+    """
+    Recursively build the probability tree for the draw of the runners-up and winners left in the pots.
+    :param runners_mask: bitmask of the runner-up ids left in the pot
+    :param winners_mask: bitmask of the winner ids left in the pot
+    :param eligible_winners: bitmask of eligible winners for each runner-up
+    :param fixtures: tuple of (runner-up id, winner id) fixtures already drawn
+    :param log_probability: cumulative log_probability
+    :param depth: counter for the tree depth
+    :return: a generator returning valid branches for the knockout draw as (fixtures, probability) tuples
+    """
+    if not runners_mask or not winners_mask:
+        yield (fixtures, np.exp(log_probability))
     else:
-        p1 = -np.log(len(pot1))
-        for runner_up in pot1:
-            new_pot1 = copy_list_and_remove_element(runner_up, pot1)
-            eligible_winners = filter_winners(runner_up, pot2)
+        p1 = -np.log(bin(runners_mask).count('1'))
+        for runner_up in iterate_bits(runners_mask):
+            new_runners_mask = runners_mask & ~(1 << runner_up)
+            candidates = eligible_winners[runner_up] & winners_mask
             if depth > 2:
-                eligible_winners = remove_winners_leading_to_dead_ends(eligible_winners, pot2,
-                                                                       runner_up, pot1)
-            p2 = -np.log(len(eligible_winners))
-            new_log_probability = log_probability + p1 + p2
-            for winner in eligible_winners:
-                new_pairings = pairings.copy()
-                new_pairings[runner_up] = winner
-                new_pot2 = copy_list_and_remove_element(winner, pot2)
-                for x in unfold_probability_tree(new_pot1, new_pot2, new_pairings,
-                                                 new_log_probability, depth + 1):
+                candidates = sum([1 << w for w in iterate_bits(candidates)
+                                  if complete_matching(dict((r, eligible_winners[r] & winners_mask & ~(1 << w))
+                                                            for r in iterate_bits(new_runners_mask)))])
+            if not candidates:
+                continue
+            new_log_probability = log_probability + p1 - np.log(bin(candidates).count('1'))
+            for winner in iterate_bits(candidates):
+                for x in unfold_fixture_tree(new_runners_mask, winners_mask & ~(1 << winner), eligible_winners,
+                                             fixtures + ((runner_up, winner),), new_log_probability, depth + 1):
                     yield x
 
 
+def build_eligible_winners(runners_up, winners):
+    """
+    Build the bitmask of eligible winners (different group and different country) for each runner-up.
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :return: a list of integers, the bit w of the item r is set if the winner w is eligible for the runner-up r
+    """
+    registry = TeamRegistry(list(runners_up) + list(winners))
+    eligibility = registry.eligibility(range(len(runners_up)), range(len(runners_up), len(registry)))
+    return [sum([1 << int(w) for w in np.where(row)[0]]) for row in eligibility]
+
+
+def build_dead_end_checker(eligible_winners, number_of_runners_up, shift):
+    """
+    Build a memoized function checking whether a state of the draw has no dead ends, that is,
+    the remaining runners-up can be matched to different eligible remaining winners.
+    :param eligible_winners: bitmask of eligible winners for each runner-up
+    :param number_of_runners_up: number of runner-up clubs
+    :param shift: states are coded as runners_mask << shift | winners_mask
+    :return: a function taking a state and returning a boolean
+    """
+    feasible_states = {}
+
+    def has_no_dead_ends(state):
+        if state not in feasible_states:
+            winners_mask = state & ((1 << shift) - 1)
+            adjacency = dict((r, eligible_winners[r] & winners_mask)
+                             for r in range(number_of_runners_up) if state >> (shift + r) & 1)
+            feasible_states[state] = complete_matching(adjacency)
+        return feasible_states[state]
+
+    return has_no_dead_ends
+
+
+def calculate_knockout_probabilities(runners_up, winners, return_number_of_states=False, eligible_winners=None):
+    """
+    Calculate the exact probabilities of every fixture following the same procedure as
+    unfold_probability_tree: a runner-up club is drawn uniformly and then a winner club is drawn
+    uniformly among those not leading to a dead end. The rest of the draw only depends on the
+    clubs remaining in both pots, so the probability of each state (bitmask of remaining runners-up
+    and remaining winners) is propagated fixture by fixture instead of unfolding every branch.
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :param return_number_of_states: return also the number of distinct reachable states
+    :param eligible_winners: bitmask of eligible winners for each runner-up (built from the teams if None)
+    :return: a [winners]x[runners_up] numpy 2D-array containing the probability of each fixture
+             (and the number of states if return_number_of_states)
+    """
+    if eligible_winners is None:
+        eligible_winners = build_eligible_winners(runners_up, winners)
+    shift = len(winners)  # states are coded as runners_mask << shift | winners_mask
+    has_no_dead_ends = build_dead_end_checker(eligible_winners, len(runners_up), shift)
+
+    probabilities = [[0.0] * len(runners_up) for _ in winners]
+    states = {(1 << (shift + len(runners_up))) - 1: 1.0}
+    number_of_states = 1
+    for _ in range(len(runners_up)):
+        next_states = {}
+        for state, probability in states.items():
+            remaining_runners = [r for r in range(len(runners_up)) if state >> (shift + r) & 1]
+            for runner_up in remaining_runners:
+                state_without_runner_up = state & ~(1 << (shift + runner_up))
+                eligible_mask = eligible_winners[runner_up] & state
+                candidates = [w for w in range(len(winners)) if eligible_mask >> w & 1 and
+                              has_no_dead_ends(state_without_runner_up & ~(1 << w))]
+                for winner in candidates:
+                    transition = probability / (len(remaining_runners) * len(candidates))
+                    probabilities[winner][runner_up] += transition
+                    next_state = state_without_runner_up & ~(1 << winner)
+                    next_states[next_state] = next_states.get(next_state, 0.0) + transition
+        states = next_states
+        number_of_states += len(states)
+    probabilities = np.array(probabilities, dtype=np.float64)
+    if return_number_of_states:
+        return probabilities, number_of_states
+    return probabilities
+
+
+def simulate_knockout_draws(runners_up, winners, simulations, random_state=None, batch_size=10000,
+                            eligible_winners=None):
+    """
+    Monte Carlo simulation of the knockout draw advancing a whole batch of simulated draws at once:
+    at each step every draw picks a random remaining runner-up and then a random eligible winner
+    not leading to a dead end. Teams are coded as integers and states as 64-bit bitmasks, so the dead-end
+    check is only performed for the distinct states reached by the batch (at most 63 teams).
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :param simulations: number of draws to be simulated
+    :param random_state: numpy RandomState (numpy global state if None)
+    :param batch_size: number of draws simulated at once
+    :param eligible_winners: bitmask of eligible winners for each runner-up (built from the teams if None)
+    :return: a [winners]x[runners_up] numpy 2D-array containing the estimated probability of each fixture
+    """
+    rng = np.random if random_state is None else random_state
+    number_of_runners_up, number_of_winners = len(runners_up), len(winners)
+    shift = number_of_winners
+    if shift + number_of_runners_up > 63:
+        raise ValueError("States of %d runners-up and %d winners do not fit in a 64-bit integer"
+                         % (number_of_runners_up, number_of_winners))
+    if eligible_winners is None:
+        eligible_winners = build_eligible_winners(runners_up, winners)
+    eligibility = np.array([[mask >> w & 1 for w in range(number_of_winners)] for mask in eligible_winners],
+                           dtype=bool)
+    has_no_dead_ends = build_dead_end_checker(eligible_winners, number_of_runners_up, shift)
+    winner_bits = np.int64(1) << np.arange(number_of_winners, dtype=np.int64)
+    counts = np.zeros(number_of_winners * number_of_runners_up, dtype=np.int64)
+    for start in range(0, simulations, batch_size):
+        size = min(batch_size, simulations - start)
+        draws = np.arange(size)
+        remaining_runners = np.ones((size, number_of_runners_up), dtype=bool)
+        remaining_winners = np.ones((size, number_of_winners), dtype=bool)
+        states = np.full(size, (1 << (shift + number_of_runners_up)) - 1, dtype=np.int64)
+        for _ in range(number_of_runners_up):
+            keys = np.where(remaining_runners, rng.random_sample(remaining_runners.shape), -1)
+            runner_up = keys.argmax(axis=1)
+            states &= ~(np.int64(1) << (shift + runner_up))
+            candidates = eligibility[runner_up] & remaining_winners
+            next_states = states[:, np.newaxis] & ~winner_bits[np.newaxis, :]
+            unique_states, inverse = np.unique(next_states[candidates], return_inverse=True)
+            # Plain integers, as the states memoized by the checker and the bitmasks of the matching
+            feasible = np.array([has_no_dead_ends(int(state)) for state in unique_states], dtype=bool)
+            candidates[candidates] = feasible[inverse]
+            keys = np.where(candidates, rng.random_sample(candidates.shape), -1)
+            winner = keys.argmax(axis=1)
+            states = next_states[draws, winner]
+            remaining_runners[draws, runner_up] = False
+            remaining_winners[draws, winner] = False
+            counts += np.bincount(winner * number_of_runners_up + runner_up,
+                                  minlength=number_of_winners * number_of_runners_up)
+    return counts.reshape((number_of_winners, number_of_runners_up)) / float(simulations)
+
+
+def count_knockout_completions(eligible_winners, number_of_winners):
+    """
+    Count the ways of completing a knockout draw in which the runners-up are matched in order:
+    for a bitmask of used winners with k bits set, the number of ways of matching the runners-up k, k+1...
+    to different eligible winners not in the bitmask (the permanent of the remaining eligibility matrix).
+    :param eligible_winners: bitmask of eligible winners for each runner-up
+    :param number_of_winners: number of winner clubs
+    :return: a numpy array of integers indexed by bitmasks of used winners
+    """
+    number_of_runners_up = len(eligible_winners)
+    completions = [0] * (1 << number_of_winners)
+    for mask in range((1 << number_of_winners) - 1, -1, -1):
+        runner_up = bin(mask).count('1')
+        if runner_up >= number_of_runners_up:
+            completions[mask] = 1
+        else:
+            completions[mask] = sum([completions[mask | 1 << w]
+                                     for w in iterate_bits(eligible_winners[runner_up] & ~mask)])
+    return np.array(completions, dtype=np.int64)
+
+
+def count_valid_knockout_draws(runners_up, winners):
+    """
+    Count the valid knockout draws, that is, the ways of pairing every runner-up with
+    a different winner from a different country and a different group.
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :return: an integer
+    """
+    return int(count_knockout_completions(build_eligible_winners(runners_up, winners), len(winners))[0])
+
+
+def sample_uniform_knockout_draws(runners_up, winners, samples, random_state=None):
+    """
+    Sample valid knockout draws uniformly: runners-up are matched in order, each one to a winner chosen
+    with probability proportional to the number of valid completions of the draw.
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :param samples: number of draws to be sampled
+    :param random_state: numpy RandomState (numpy global state if None)
+    :return: a [samples]x[runners_up] numpy 2D-array containing the index of the winner playing each runner-up
+    """
+    rng = np.random if random_state is None else random_state
+    eligible_winners = build_eligible_winners(runners_up, winners)
+    completions = count_knockout_completions(eligible_winners, len(winners))
+    if completions[0] == 0:
+        raise ValueError("There is no valid knockout draw")
+    winner_bits = np.int64(1) << np.arange(len(winners), dtype=np.int64)
+    masks = np.zeros(samples, dtype=np.int64)
+    draws = np.empty((samples, len(runners_up)), dtype=int)
+    for runner_up, eligible_mask in enumerate(eligible_winners):
+        candidates = (eligible_mask & winner_bits != 0)[np.newaxis, :] & (masks[:, np.newaxis] & winner_bits == 0)
+        weights = np.where(candidates, completions[masks[:, np.newaxis] | winner_bits], 0).cumsum(axis=1)
+        thresholds = rng.random_sample(samples) * weights[:, -1]
+        draws[:, runner_up] = (weights <= thresholds[:, np.newaxis]).sum(axis=1)
+        masks |= winner_bits[draws[:, runner_up]]
+    return draws
+
+
+def calculate_uniform_knockout_probabilities(runners_up, winners, eligible_winners=None):
+    """
+    Calculate the probabilities of every fixture when the draw is taken uniformly from all the valid draws,
+    counting the valid draws containing each fixture instead of enumerating them.
+    :param runners_up: list of Team instances for runner-up clubs
+    :param winners: list of Team instances for winner clubs
+    :param eligible_winners: bitmask of eligible winners for each runner-up (built from the teams if None)
+    :return: a [winners]x[runners_up] numpy 2D-array containing the probability of each fixture
+    """
+    if eligible_winners is None:
+        eligible_winners = build_eligible_winners(runners_up, winners)
+    completions = count_knockout_completions(eligible_winners, len(winners))
+    if completions[0] == 0:
+        raise ValueError("There is no valid knockout draw")
+    # Ways of matching the first runners-up to the winners of each bitmask
+    beginnings = {0: 1}
+    probabilities = np.zeros((len(winners), len(runners_up)), dtype=np.float64)
+    for runner_up, eligible_mask in enumerate(eligible_winners):
+        next_beginnings = {}
+        for mask, ways in beginnings.items():
+            for winner in iterate_bits(eligible_mask & ~mask):
+                next_mask = mask | 1 << winner
+                probabilities[winner, runner_up] += ways * int(completions[next_mask])
+                next_beginnings[next_mask] = next_beginnings.get(next_mask, 0) + ways
+        beginnings = next_beginnings
+    return probabilities / int(completions[0])
+
+
 def build_html_table(runners_up, winners, probabilities):
     """
     Build the HTML code for a table showing the probabilities for each fixture
@@ -0,0 +1,69 @@
+def find_augmenting_path(node, adjacency, owners, visited):
+    """
+    Depth-first search of an augmenting path starting at the left node.
+    If a path is found, the matching stored in owners is augmented along it.
+    :param node: left node from which the path starts
+    :param adjacency: dictionary with left nodes as keys and bitmasks of adjacent right nodes as values
+    :param owners: dictionary with matched right nodes as keys and their left nodes as values
+    :param visited: one-element list containing the bitmask of right nodes already visited
+    :return: a boolean
+    """
+    candidates = adjacency[node] & ~visited[0]
+    while candidates:
+        bit = candidates & -candidates
+        candidates ^= bit
+        visited[0] |= bit
+        right = bit.bit_length() - 1
+        owner = owners.get(right)
+        if owner is None or find_augmenting_path(owner, adjacency, owners, visited):
+            owners[right] = node
+            return True
+    return False
+
+
+def complete_matching(adjacency, owners=None):
+    """
+    Complete a matching in which every left node is matched to a different right node.
+    A previous matching can be reused: its edges not present in adjacency anymore are dropped
+    and just the unmatched left nodes are augmented, so small changes in the graph are cheap.
+    :param adjacency: dictionary with left nodes as keys and bitmasks of adjacent right nodes as values
+    :param owners: dictionary with matched right nodes as keys and their left nodes as values.
+                   It is updated in place
+    :return: a boolean, True if every left node could be matched
+    """
+    if owners is None:
+        owners = {}
+    matched = set()
+    for right, left in list(owners.items()):
+        if left in adjacency and left not in matched and adjacency[left] >> right & 1:
+            matched.add(left)
+        else:
+            del owners[right]
+    for left in adjacency:
+        if left not in matched and not find_augmenting_path(left, adjacency, owners, [0]):
+            return False
+    return True
+
+
+def build_adjacency(left_nodes, right_nodes, is_edge):
+    """
+    Build the bitmask adjacency of a bipartite graph.
+    :param left_nodes: list of left nodes
+    :param right_nodes: list of right nodes, the bit of each right node is its position in the list
+    :param is_edge: function taking a left node and a right node and returning a boolean
+    :return: a dictionary with left nodes as keys and bitmasks of adjacent right nodes as values
+    """
+    return dict((left, sum([1 << idx for idx, right in enumerate(right_nodes) if is_edge(left, right)]))
+                for left in left_nodes)
+
+
+def iterate_bits(mask):
+    """
+    Iterate over the positions of the bits set in a bitmask, from the lowest to the highest.
+    :param mask: bitmask
+    :return: a generator of integers
+    """
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        yield bit.bit_length() - 1
@@ -1,23 +1,98 @@
-class Team:
+import numpy as np
+
+
+class Team(object):
     """
     Team representation storing club information regarding:
         - short name
         - association/country to which the club belongs
         - group in the previous stage of the Champions League
+    Instances are immutable, so the hash is computed just once.
     """
+    __slots__ = ('_name', '_country', '_group', '_hash')
+
     def __init__(self, name, country, group):  # Constructor
-        self.name = name
-        self.country = country
-        self.group = group
+        self._name = name
+        self._country = country
+        self._group = group
+        self._hash = hash((name, country, group))
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def country(self):
+        return self._country
+
+    @property
+    def group(self):
+        return self._group
 
     def __repr__(self):  # String representation of instances
         return '{} ({}, {})'.format(self.name, self.group, self.country)
 
     def __hash__(self):  # Required for list.index working
-        return hash((self.name, self.country, self.group))
+        return self._hash
 
     def __eq__(self, other):  # Required for list.index working
+        if self is other:
+            return True
+        if isinstance(other, Team) and self._hash != other._hash:
+            return False
         try:
             return (self.name, self.country, self.group) == (other.name, other.country, other.group)
         except AttributeError:
             return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+
+class TeamRegistry(object):
+    """
+    Struct-of-arrays view of a list of teams giving each team a stable integer id (its position in the list):
+        - names: numpy array of team names
+        - countries: numpy array of country codes (positions in country_names)
+        - groups: numpy array of group codes (positions in group_names)
+    Sets of teams can then be handled as bitmasks of ids.
+    """
+    def __init__(self, teams):
+        self.teams = list(teams)
+        self.ids = dict((team, idx) for idx, team in enumerate(self.teams))
+        self.names = np.array([team.name for team in self.teams])
+        self.country_names = sorted(set(team.country for team in self.teams))
+        self.countries = np.array([self.country_names.index(team.country) for team in self.teams], dtype=int)
+        self.group_names = sorted(set(team.group for team in self.teams))
+        self.groups = np.array([self.group_names.index(team.group) for team in self.teams], dtype=int)
+
+    def __len__(self):
+        return len(self.teams)
+
+    def encode(self, teams):
+        """
+        Build the bitmask of a list of teams.
+        :param teams: list of Team instances belonging to the registry
+        :return: an integer
+        """
+        return sum([1 << self.ids[team] for team in teams])
+
+    def decode(self, mask):
+        """
+        Build the list of teams of a bitmask.
+        :param mask: bitmask of team ids
+        :return: a list of Team instances ordered by id
+        """
+        return [team for idx, team in enumerate(self.teams) if mask >> idx & 1]
+
+    def eligibility(self, first_ids, second_ids):
+        """
+        Teams can be paired if they belong to different countries and played in different groups.
+        :param first_ids: list of team ids
+        :param second_ids: list of team ids
+        :return: a [first_ids]x[second_ids] boolean numpy 2D-array
+        """
+        first_ids, second_ids = np.asarray(first_ids, dtype=int), np.asarray(second_ids, dtype=int)
+        return (self.countries[first_ids][:, np.newaxis] != self.countries[second_ids][np.newaxis, :]) & \
+               (self.groups[first_ids][:, np.newaxis] != self.groups[second_ids][np.newaxis, :])
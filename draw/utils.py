@@ -1,3 +1,5 @@
+import math
+import numpy as np
 from IPython.display import display_html
 
 
@@ -13,6 +15,56 @@ def copy_list_and_remove_element(element, list_of_elements):
     return copied_list
 
 
+def binomial_coefficient(n, k):
+    """
+    Number of ways of choosing k elements from a set of n elements.
+    :param n: size of the set
+    :param k: number of elements to be chosen
+    :return: an integer (0 if k is not between 0 and n)
+    """
+    if k < 0 or k > n:
+        return 0
+    return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+
+def unrank_permutation(elements, rank):
+    """
+    Permutation of the elements at the position rank in lexicographic order of positions.
+    :param elements: list of elements
+    :param rank: integer between 0 and factorial(len(elements)) - 1
+    :return: a list with the permuted elements
+    """
+    remaining = list(elements)
+    permutation = []
+    for idx in range(len(elements) - 1, -1, -1):
+        position, rank = divmod(rank, math.factorial(idx))
+        permutation.append(remaining.pop(position))
+    return permutation
+
+
+def spawn_random_states(seed, number_of_states):
+    """
+    Spawn independent and reproducible random states from a root seed.
+    The i-th random state only depends on seed and i, not on number_of_states.
+    :param seed: root seed (a random one is taken from the numpy global state if None)
+    :param number_of_states: number of random states to be spawned
+    :return: a list of numpy RandomState instances
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    return [spawn_random_state(seed, idx) for idx in range(number_of_states)]
+
+
+def spawn_random_state(seed, idx):
+    """
+    Spawn the idx-th random state from a root seed.
+    :param seed: root seed
+    :param idx: index of the random state
+    :return: a numpy RandomState instance
+    """
+    return np.random.RandomState([seed, idx])
+
+
 def show_group_stage_draw_result(draw, clubs, clubs_per_pot):
     """
     Print the result of a draw in the form of group composition.
@@ -0,0 +1,138 @@
+import numpy as np
+from engine import DrawEngine, LabelCap, PreAssignment
+from group_stage_simulator import count_clubs_in_same_group
+from utils import spawn_random_state
+
+
+class VectorizedDrawEngine(DrawEngine):
+    """
+    Draw engine simulating a whole batch of draws at once with numpy, one team per pot position at a time.
+    It reuses the feasibility kernel compiled by DrawEngine from LabelCap, CountryProtection and PreAssignment
+    rules, kept as arrays with one row per draw:
+        - counters of each (rule, label) per group
+        - bitmask of the groups still available in the pot
+    Each draw gets its own random order of every pot, and draws reaching a dead end are restarted,
+    so it follows the procedure of DrawEngine with avoid_dead_ends=False.
+    """
+    def __init__(self, team_pots, number_of_groups, rules, choose_first_group=False):
+        """
+        :param team_pots: pot number of each team (starting at 1)
+        :param number_of_groups: number of groups
+        :param rules: list of LabelCap, CountryProtection and PreAssignment instances
+        :param choose_first_group: assign the first allowed group instead of a random one
+        """
+        DrawEngine.__init__(self, team_pots, number_of_groups, rules, choose_first_group, avoid_dead_ends=False)
+        if any([timetable > -1 for timetable in self.timetables]):
+            raise ValueError("Timetable separation is not supported by the vectorized engine")
+        # Teams with fewer counters point the missing ones to an extra counter without cap
+        rules_per_team = max([len(counters) for counters in self.team_counters] + [1])
+        self.team_counter_array = np.full((self.number_of_teams, rules_per_team), len(self.caps), dtype=int)
+        for team, counters in enumerate(self.team_counters):
+            self.team_counter_array[team, :len(counters)] = counters
+        self.cap_array = np.append(self.caps, self.number_of_teams + 1)
+
+    def simulate_batch(self, size, random_state):
+        """
+        Simulate a batch of draws without restarting those reaching a dead end.
+        :param size: number of draws
+        :param random_state: numpy RandomState
+        :return: a tuple ([size]x[number_of_groups]x[number_of_pots] numpy 3D-array containing team indexes,
+                 boolean numpy array telling which draws did not reach a dead end)
+        """
+        rows = np.arange(size)
+        draws = np.full((size, self.number_of_groups, self.number_of_pots), -1, dtype=int)
+        counts = np.zeros((size, self.number_of_groups, len(self.cap_array)), dtype=int)
+        valid = np.ones(size, dtype=bool)
+        for pot_idx, teams in enumerate(self.pots):
+            available = np.ones((size, self.number_of_groups), dtype=bool)
+            for team in teams:
+                group = self.fixed_groups[team]
+                if group is not None:
+                    counters = self.team_counter_array[team]
+                    valid &= (counts[:, group, counters] < self.cap_array[counters]).all(axis=1)
+                    counts[:, group, counters] += 1
+                    available[:, group] = False
+                    draws[:, group, pot_idx] = team
+            teams_in_pot = np.array([team for team in teams if self.fixed_groups[team] is None], dtype=int)
+            if len(teams_in_pot) == 0:
+                continue
+            orders = teams_in_pot[np.argsort(random_state.random_sample((size, len(teams_in_pot))), axis=1)]
+            for position in range(len(teams_in_pot)):
+                drawn_teams = orders[:, position]
+                counters = self.team_counter_array[drawn_teams]
+                allowed = available.copy()
+                for rule_idx in range(counters.shape[1]):
+                    column = counters[:, rule_idx]
+                    allowed &= counts[rows, :, column] < self.cap_array[column][:, np.newaxis]
+                valid &= allowed.any(axis=1)
+                if self.choose_first_group:
+                    groups = np.argmax(allowed, axis=1)
+                else:
+                    groups = np.argmax(np.where(allowed, random_state.random_sample(allowed.shape), -1), axis=1)
+                available[rows, groups] = False
+                for rule_idx in range(counters.shape[1]):
+                    counts[rows, groups, counters[:, rule_idx]] += 1
+                draws[rows, groups, pot_idx] = drawn_teams
+        return draws, valid
+
+    def simulate(self, simulations, random_state=None, dtype=int, batch_size=100000):
+        """
+        Simulate the number of draws required in batches, restarting the draws reaching a dead end.
+        :param simulations: number of draws to be simulated
+        :param random_state: numpy RandomState (numpy global state if None)
+        :param dtype: integer type of the array of draws
+        :param batch_size: maximum number of draws simulated at once
+        :return: a [simulations]x[number_of_groups]x[number_of_pots] numpy 3D-array containing team indexes
+        """
+        rng = np.random if random_state is None else random_state
+        draws = np.full((simulations, self.number_of_groups, self.number_of_pots), -1, dtype=dtype)
+        simulation = 0
+        while simulation < simulations:
+            batch, valid = self.simulate_batch(min(batch_size, simulations - simulation), rng)
+            batch = batch[valid]
+            draws[simulation:simulation + batch.shape[0]] = batch
+            simulation += batch.shape[0]
+        return draws
+
+
+def build_world_cup_engine(team_pots, team_confederations, confederation_caps, hosts, choose_first_group=True):
+    """
+    Vectorized draw engine for the World Cup group stage as simulated in the notebook: teams of each pot
+    are drawn in random order and placed in the first group not exceeding the cap of their confederation.
+    :param team_pots: pot number of each team
+    :param team_confederations: confederation of each team
+    :param confederation_caps: maximum number of teams of each confederation per group
+    :param hosts: dictionary (team: group) of teams placed before the draw
+    :param choose_first_group: assign the first allowed group instead of a random one
+    :return: a VectorizedDrawEngine instance
+    """
+    return VectorizedDrawEngine(team_pots, len(team_pots) // len(set(team_pots)),
+                                [LabelCap(team_confederations, confederation_caps), PreAssignment(hosts)],
+                                choose_first_group)
+
+
+def estimate_world_cup_probabilities(simulations, team_pots, team_confederations, confederation_caps, hosts,
+                                     seed=None, batch_size=100000, choose_first_group=True):
+    """
+    Estimate the probabilities of each pair of teams to be in the same group of the World Cup,
+    counting the draws batch by batch so memory does not depend on the number of simulations.
+    :param simulations: number of draws to be simulated
+    :param team_pots: pot number of each team
+    :param team_confederations: confederation of each team
+    :param confederation_caps: maximum number of teams of each confederation per group
+    :param hosts: dictionary (team: group) of teams placed before the draw
+    :param seed: root seed from which the random states of the batches are spawned (random if None)
+    :param batch_size: number of draws simulated at once
+    :param choose_first_group: assign the first allowed group instead of a random one
+    :return: a [teams]x[teams] numpy 2D-array containing the probability for each pair of teams
+             belonging to the same group
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    engine = build_world_cup_engine(team_pots, team_confederations, confederation_caps, hosts, choose_first_group)
+    counts = np.zeros((len(team_pots), len(team_pots)), dtype=np.int64)
+    for batch, start in enumerate(range(0, simulations, batch_size)):
+        draws = engine.simulate(min(batch_size, simulations - start), spawn_random_state(seed, batch), np.int8,
+                                batch_size)
+        counts += count_clubs_in_same_group(draws, len(team_pots), batch_size)
+    return (counts / float(simulations)).astype(np.float32)
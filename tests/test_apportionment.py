@@ -0,0 +1,80 @@
+"""
+Regression tests of the apportionment of seats against the parliaments calculated by the original implementation
+(sorting the whole parties x seats table of averages), stored in data/parliament_seats.csv, and of the highest averages
+kernel on constituencies without seats.
+Usage: python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+import pandas as pd
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DATA_DIRECTORY = os.path.join(DIRECTORY, os.pardir, 'data')
+sys.path.insert(0, os.path.join(DIRECTORY, os.pardir, 'voting'))
+# draw/ and voting/ both have a top-level utils module: keep the one already imported alive, out of the way
+OTHER_UTILS = sys.modules.pop('utils', None)
+
+from apportionment import (allocate_seats, assign_constituency_representatives, calculate_parliament,
+                          get_allowed_formulas)
+from constants import CONSTITUENCY, OPTION, PARTY, SEATS, VOTES
+
+THRESHOLDS = [0.0, 3.0, 5.0]
+
+
+def load_election(election):
+    """
+    :param election: name of a file of the data directory without extension
+    :return: a tuple with the dataframe and the constituencies arguments of calculate_parliament
+    """
+    df = pd.read_csv(os.path.join(DATA_DIRECTORY, '%s.csv' % election))
+    constituencies = df[[CONSTITUENCY, SEATS]].groupby(by=CONSTITUENCY).agg({SEATS: sum}).to_dict()[SEATS]
+    return df[[CONSTITUENCY, OPTION, VOTES]].set_index([CONSTITUENCY, OPTION]), constituencies
+
+
+class CalculateParliamentTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.expected = pd.read_csv(os.path.join(DIRECTORY, 'data', 'parliament_seats.csv'))
+
+    def check_parliament(self, election, formula, threshold, parliament):
+        expected = self.expected[(self.expected['Election'] == election) & (self.expected['Formula'] == formula) &
+                                 (self.expected['Threshold'] == threshold)].set_index(PARTY)[[VOTES, SEATS]]
+        message = '%s, %s, %.0f%%' % (election, formula, threshold)
+        self.assertFalse(expected.empty, message)
+        self.assertTrue(parliament[SEATS].is_monotonic_decreasing, message)
+        self.assertEqual(sorted(parliament.index), sorted(expected.index), message)
+        for column in [VOTES, SEATS]:
+            self.assertEqual(parliament[column].astype(int).to_dict(), expected[column].to_dict(), message)
+
+    def test_vectorized_parliaments(self):
+        for election in self.expected['Election'].unique():
+            dataframe, constituencies = load_election(election)
+            for formula in get_allowed_formulas():
+                for threshold in THRESHOLDS:
+                    parliament = calculate_parliament(dataframe, constituencies, formula, threshold, verbose=False,
+                                                      vectorized=True)
+                    self.check_parliament(election, formula, threshold, parliament)
+
+    def test_parliaments(self):
+        election = 'spanish_congress_2016_06'
+        dataframe, constituencies = load_election(election)
+        for formula in get_allowed_formulas():
+            parliament = calculate_parliament(dataframe, constituencies, formula, 3.0, verbose=False)
+            self.check_parliament(election, formula, 3.0, parliament)
+
+
+class AllocateSeatsTest(unittest.TestCase):
+    def test_no_seats(self):
+        for formula in get_allowed_formulas():
+            self.assertEqual(allocate_seats([10, 5, 1], 0, formula), [0, 0, 0])
+            self.assertEqual(allocate_seats([], 0, formula), [])
+
+    def test_constituency_without_seats(self):
+        dataframe = pd.DataFrame({OPTION: ['A', 'B', 'C'], VOTES: [10, 5, 1]})
+        for formula in get_allowed_formulas():
+            self.assertTrue(assign_constituency_representatives(dataframe.copy(), 0, formula).empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Regression tests of the group stage simulator against the draws simulated by the original implementation
+(networkx matchings and per-candidate checks), stored in data/group_stage_draws.npz,
+and of the uniform sampler against the enumeration of every draw of a mid-size configuration.
+Usage: python -m unittest discover -s tests
+"""
+import itertools
+import os
+import sys
+import unittest
+import numpy as np
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(DIRECTORY, os.pardir, 'benchmarks'))
+# draw/ and voting/ both have a top-level utils module: keep the one already imported alive, out of the way
+OTHER_UTILS = sys.modules.pop('utils', None)
+
+from configurations import champions_league_2018_group_stage, europa_league_2018_group_stage
+from group_stage_simulator import (count_clubs_in_same_group, count_timetable_valid_draws, sample_uniform_draws,
+                                   simulate_draw)
+
+SEED = 2018
+
+
+class SimulateDrawTest(unittest.TestCase):
+    def setUp(self):
+        self.expected_draws = np.load(os.path.join(DIRECTORY, 'data', 'group_stage_draws.npz'))
+
+    def check_draws(self, name, config):
+        expected = self.expected_draws[name]
+        draws = simulate_draw(expected.shape[0], *config, show_errors=False,
+                              random_state=np.random.RandomState(SEED), dtype=np.int8)
+        np.testing.assert_array_equal(draws, expected)
+
+    def test_champions_league_draws(self):
+        self.check_draws('champions_league', champions_league_2018_group_stage())
+
+    def test_europa_league_draws(self):
+        self.check_draws('europa_league', europa_league_2018_group_stage())
+
+
+def mid_size_group_stage():
+    """
+    Draw of 16 clubs in 4 pots and 4 groups, with two timetables of 2 groups, association conflicts
+    between pots and paired clubs both in different pots and in the same pot.
+    :return: a tuple with the positional arguments of simulate_draw after the number of simulations
+    """
+    clubs = ["Club %d" % idx for idx in range(16)]
+    associations = ["ESP", "ENG", "GER", "ITA", "ESP", "NED", "FRA", "POR",
+                    "GER", "SCO", "AUT", "BEL", "RUS", "UKR", "ENG", "TUR"]
+    club_pots = [1] * 4 + [2] * 4 + [3] * 4 + [4] * 4
+    paired_clubs = {}
+    for club1, club2 in [(0, 5), (2, 8), (9, 12), (10, 11)]:
+        paired_clubs[club1], paired_clubs[club2] = club2, club1
+    return clubs, 4, 4, club_pots, associations, paired_clubs, [0, 1], [2, 3]
+
+
+def enumerate_draws(clubs_per_pot, number_of_pots, club_pots):
+    """
+    Every draw placing the clubs of each pot in different groups.
+    :return: a [draws]x[clubs_per_pot]x[number_of_pots] numpy 3D-array containing club indexes
+    """
+    permutations = np.array(list(itertools.permutations(range(clubs_per_pot))))
+    choices = np.indices((len(permutations),) * number_of_pots).reshape((number_of_pots, -1))
+    draws = np.empty((choices.shape[1], clubs_per_pot, number_of_pots), dtype=int)
+    rows = np.arange(choices.shape[1])[:, np.newaxis]
+    for pot_idx in range(number_of_pots):
+        clubs_in_pot = np.array([club for club, pot in enumerate(club_pots) if pot == pot_idx + 1])
+        draws[rows, permutations[choices[pot_idx]], pot_idx] = clubs_in_pot
+    return draws
+
+
+class UniformDrawSamplerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config = mid_size_group_stage()
+        _, clubs_per_pot, number_of_pots, club_pots, associations, paired_clubs, first, second = cls.config
+        draws = enumerate_draws(clubs_per_pot, number_of_pots, club_pots)
+        club_groups = np.empty((draws.shape[0], len(club_pots)), dtype=int)
+        for group in range(clubs_per_pot):
+            for pot_idx in range(number_of_pots):
+                club_groups[np.arange(draws.shape[0]), draws[:, group, pot_idx]] = group
+        timetables = np.array([0 if group in first else 1 for group in range(clubs_per_pot)])
+        cls.timetable_valid = np.ones(draws.shape[0], dtype=bool)
+        for club, paired_club in paired_clubs.items():
+            cls.timetable_valid &= timetables[club_groups[:, club]] != timetables[club_groups[:, paired_club]]
+        valid = cls.timetable_valid.copy()
+        for club1, club2 in itertools.combinations(range(len(club_pots)), 2):
+            if associations[club1] == associations[club2]:
+                valid &= club_groups[:, club1] != club_groups[:, club2]
+        cls.valid_draws = draws[valid]
+
+    def test_count_timetable_valid_draws(self):
+        _, clubs_per_pot, number_of_pots, club_pots, _, paired_clubs, first, second = self.config
+        self.assertEqual(count_timetable_valid_draws(clubs_per_pot, number_of_pots, club_pots, paired_clubs,
+                                                     first, second), int(self.timetable_valid.sum()))
+
+    def test_same_group_probabilities(self):
+        samples = 5000
+        draws, acceptance_rate = sample_uniform_draws(samples, *self.config, random_state=np.random.RandomState(SEED),
+                                                      return_acceptance_rate=True)
+        expected = count_clubs_in_same_group(self.valid_draws, len(self.config[0])) / float(len(self.valid_draws))
+        estimated = count_clubs_in_same_group(draws, len(self.config[0])) / float(samples)
+        standard_errors = np.sqrt(expected * (1 - expected) / samples)
+        self.assertTrue((np.abs(estimated - expected) <= 5 * standard_errors + 1e-12).all())
+        self.assertAlmostEqual(acceptance_rate, len(self.valid_draws) / float(self.timetable_valid.sum()), delta=0.03)
+
+
+if __name__ == '__main__':
+    unittest.main()
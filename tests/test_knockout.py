@@ -0,0 +1,37 @@
+"""
+Regression tests of the exact knockout probabilities against the probability tree unfolded by the original
+implementation, stored in data/knockout_probabilities.npy. Unfolding the whole Champions League 2018-2019 round of 16
+takes hours, so the stored probabilities are those of its first 7 group winners and runners-up.
+Usage: python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+import numpy as np
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(DIRECTORY, os.pardir, 'benchmarks'))
+# draw/ and voting/ both have a top-level utils module: keep the one already imported alive, out of the way
+OTHER_UTILS = sys.modules.pop('utils', None)
+
+from configurations import champions_league_2018_knockout_stage
+from knockout_stage_simulator import calculate_knockout_probabilities
+
+NUMBER_OF_GROUPS = 7
+
+
+class KnockoutProbabilitiesTest(unittest.TestCase):
+    def test_probability_tree(self):
+        expected = np.load(os.path.join(DIRECTORY, 'data', 'knockout_probabilities.npy'))
+        runners_up, winners = champions_league_2018_knockout_stage()
+        probabilities = calculate_knockout_probabilities(runners_up[:NUMBER_OF_GROUPS], winners[:NUMBER_OF_GROUPS])
+        np.testing.assert_allclose(probabilities, expected, rtol=0, atol=1e-9)
+
+    def test_champions_league_fixtures(self):
+        probabilities = calculate_knockout_probabilities(*champions_league_2018_knockout_stage())
+        np.testing.assert_allclose(probabilities.sum(axis=0), 1.0)
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import heapq
 import numpy as np
 import pandas as pd
 from utils import get_constituency_votes
@@ -49,6 +50,33 @@ def get_divisors(formula, number_of_representatives):
         raise ValueError("formula parameter must be one of the following values: %s" % ", ".join(get_allowed_formulas()))
 
 
+def allocate_seats(votes, number_of_representatives, formula="d'Hondt"):
+    """
+    Highest averages kernel: seats are given one by one to the party with the highest average
+    votes / divisor of its next seat, kept in a heap, so it takes O(seats * log(parties)) steps
+    instead of sorting the whole parties x seats table of averages. Ties go to the first party.
+    :param votes: list of votes of each party
+    :param number_of_representatives: integer
+    :param formula: apportionment rule.
+                    Valid values: d'Hondt, Sainte-Lague, Modified Sainte-Lague, Danish, Imperiali
+    :return: a list with the number of seats of each party
+    """
+    seats = [0] * len(votes)
+    if number_of_representatives <= 0:
+        return seats
+    divisors = get_divisors(formula, number_of_representatives)
+    heap = [(-vote / float(divisors[0]), idx) for idx, vote in enumerate(votes)]
+    heapq.heapify(heap)
+    for _ in range(number_of_representatives if len(votes) > 0 else 0):
+        _, idx = heap[0]
+        seats[idx] += 1
+        if seats[idx] < number_of_representatives:
+            heapq.heapreplace(heap, (-votes[idx] / float(divisors[seats[idx]]), idx))
+        else:
+            heapq.heappop(heap)
+    return seats
+
+
 def assign_constituency_representatives(dataframe, number_of_representatives, formula="d'Hondt", minimum_percentage=3.0):
     """
     Distribute <number_of_representatives> seats among the parties included in the rows of the dataframe
@@ -61,15 +89,10 @@ def assign_constituency_representatives(dataframe, number_of_representatives, fo
     :return: dataframe with a row for each party with a least one seat assigned, indexing by <OPTION> and
              having two columns <SEATS> and <VOTES>
     """
-    n = number_of_representatives
     df = filter_data_by_minimum_percentage(dataframe, minimum_percentage)
     parties = df[OPTION].tolist()
-    votes = df[VOTES].tolist()
-    divisors = get_divisors(formula, n)
-    averages_table = np.array([[vote/float(r) for r in divisors] for vote in votes])
-    seats = np.dstack(np.unravel_index(np.argsort(-averages_table.ravel()), averages_table.shape))[0, 0:n, 0:2]
-    party_with_seat_idx = set([x for x, y in seats])
-    seats = {parties[idx]:max([(y+1) for x, y in seats if x == idx]) for idx in party_with_seat_idx}
+    seats = allocate_seats(df[VOTES].tolist(), number_of_representatives, formula)
+    seats = dict((party, party_seats) for party, party_seats in zip(parties, seats) if party_seats > 0)
     df = df.set_index(OPTION)
     df[SEATS] = pd.Series(seats)
     df.dropna(inplace=True)
@@ -77,7 +100,71 @@ def assign_constituency_representatives(dataframe, number_of_representatives, fo
     return df.sort_values([SEATS], ascending=False)
 
 
-def calculate_parliament(dataframe, constituencies, formula="d'Hondt", minimum_percentage=3.0, verbose=True):
+def build_vote_matrix(dataframe, constituencies):
+    """
+    Arrange the votes of every option in every constituency as a dense matrix
+    :param dataframe: assume two indexes <OPTION, CONSTITUENCY> and one column <VOTES>
+    :param constituencies: dictionary with constituency name as keys and number of seats as values
+    :return: a 4-tuple with the list of constituencies, the list of options, a [constituencies]x[options]
+             numpy array of votes (0 where an option did not run) and a numpy array with the seats of each constituency.
+             Options running several lists in a constituency (e.g. independent candidates) get a column per list
+    """
+    names = list(constituencies.keys())
+    votes = dataframe[VOTES].reset_index()
+    votes['list'] = votes.groupby(list(dataframe.index.names)).cumcount()
+    votes = votes.set_index([CONSTITUENCY, OPTION, 'list'])[VOTES].unstack([OPTION, 'list'], fill_value=0)
+    votes = votes.sort_index(axis=1).loc[names]
+    seats = np.array([constituencies[name] for name in names])
+    return names, [option for option, _ in votes.columns], votes.values, seats
+
+
+def allocate_seats_in_batch(votes, seats, options, formula="d'Hondt", minimum_percentage=3.0, chunk_size=10000):
+    """
+    Apply the threshold and the highest averages rule to many vote vectors at once (constituencies, scenarios...):
+    the S-th highest average of every party and seat is found with a single numpy partition for each chunk
+    of vote vectors with S seats, and just the vote vectors with ties are fully sorted.
+    Thresholds, valid votes and ties work as in assign_constituency_representatives.
+    :param votes: numpy array of votes whose last axis runs over the options
+    :param seats: number of seats of each vote vector (a number, or an array with the shape of votes but the last axis)
+    :param options: list of options, used to exclude abstention, invalid and blank votes from the apportionment
+    :param formula: apportionment rule.
+                    Valid values: d'Hondt, Sainte-Lague, Modified Sainte-Lague, Danish, Imperiali
+    :param minimum_percentage: float as a percentage non as a ratio. Default value according to the Spanish law
+    :param chunk_size: number of vote vectors ranked at once, to keep the table of averages bounded in memory
+    :return: an integer numpy array with the shape of votes containing the seats of each option
+    """
+    votes = np.asarray(votes, dtype=np.float64)
+    counted = ~np.isin(options, IGNORED_OPTION_LIST)
+    eligible = counted & (np.array(options, dtype=object) != OPTION_BLANK_VOTE)
+    flat_votes = votes.reshape((-1, votes.shape[-1]))
+    flat_seats = np.broadcast_to(np.asarray(seats, dtype=int), votes.shape[:-1]).ravel()
+    divisors = np.array(get_divisors(formula, max(int(flat_seats.max()), 1) if flat_seats.size else 1),
+                        dtype=np.float64)
+    result = np.zeros(flat_votes.shape, dtype=int)
+    for start in range(0, flat_votes.shape[0], chunk_size):
+        chunk, chunk_seats = flat_votes[start:start + chunk_size], flat_seats[start:start + chunk_size]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            passing = eligible & (100 * chunk / chunk[:, counted].sum(axis=1)[:, np.newaxis] > minimum_percentage)
+        averages = np.where(passing[:, :, np.newaxis], chunk[:, :, np.newaxis] / divisors, -np.inf)
+        averages = averages.reshape((chunk.shape[0], -1))
+        won = np.zeros(averages.shape, dtype=bool)
+        # Averages not lower than the S-th highest one win a seat, unless ties make more than S of them
+        for number_of_seats in np.unique(chunk_seats[chunk_seats > 0]):
+            rows = np.flatnonzero(chunk_seats == number_of_seats)
+            thresholds = -np.partition(-averages[rows], number_of_seats - 1, axis=1)[:, number_of_seats - 1]
+            won[rows] = (averages[rows] >= thresholds[:, np.newaxis]) & (averages[rows] > -np.inf)
+        ties = np.flatnonzero(won.sum(axis=1) > chunk_seats)
+        if len(ties) > 0:
+            order = np.argsort(-averages[ties], axis=1, kind='mergesort')  # stable, so ties go to the first party
+            ranks = np.empty_like(order)
+            ranks[np.arange(len(ties))[:, np.newaxis], order] = np.arange(order.shape[1])
+            won[ties] = (ranks < chunk_seats[ties, np.newaxis]) & (averages[ties] > -np.inf)
+        result[start:start + chunk_size] = won.reshape((chunk.shape[0], chunk.shape[1], -1)).sum(axis=2)
+    return result.reshape(votes.shape)
+
+
+def calculate_parliament(dataframe, constituencies, formula="d'Hondt", minimum_percentage=3.0, verbose=True,
+                         vectorized=False):
     """
     For each constituency in <constituencies>, distribute a number of seats among the parties included
     in the rows of the dataframe according to the <formula> for proportional representation
@@ -87,10 +174,23 @@ def calculate_parliament(dataframe, constituencies, formula="d'Hondt", minimum_p
                     Valid values: d'Hondt, Sainte-Lague, Modified Sainte-Lague, Danish, Imperiali
     :param minimum_percentage: float as a percentage non as a ratio. Default value according to the Spanish law
     :param verbose: if True it is shown the apportionment details by constituency
+    :param vectorized: apportion every constituency at once with allocate_seats_in_batch
     :return: a sorted dataframe by number of seats assigned having
     """
     votes_by_option = dataframe.groupby([OPTION]).sum()
-    parlament = pd.DataFrame(columns=[VOTES, SEATS])
+    if vectorized:
+        names, options, votes, seats = build_vote_matrix(dataframe, constituencies)
+        seats = allocate_seats_in_batch(votes, seats, options, formula, minimum_percentage)
+        if verbose:
+            for name, constituency_seats in zip(names, seats):
+                print("%s: %s" % (name, dict((options[idx], constituency_seats[idx])
+                                             for idx in np.flatnonzero(constituency_seats))))
+        parlament = pd.Series(seats.sum(axis=0), index=options).groupby(level=0).sum()
+        parlament = parlament[parlament > 0].to_frame(SEATS)
+        parlament.index.name = PARTY
+        parlament.insert(0, VOTES, votes_by_option.loc[parlament.index, VOTES].values)
+        return parlament.sort_values([SEATS], ascending=False)
+    apportionments = []
     for constituency, number_of_representatives in constituencies.items():
         constituency_df = get_constituency_votes(dataframe, constituency)
         constituency_df = assign_constituency_representatives(constituency_df,
@@ -99,7 +199,8 @@ def calculate_parliament(dataframe, constituencies, formula="d'Hondt", minimum_p
                                                               minimum_percentage)
         if verbose:
             print("%s: %s" % (constituency, constituency_df[SEATS].to_dict()))
-        parlament = parlament.append(constituency_df)
+        apportionments.append(constituency_df)
+    parlament = pd.concat(apportionments, sort=False) if apportionments else pd.DataFrame(columns=[VOTES, SEATS])
     parlament.index.name = PARTY
     parlament = parlament.reset_index().groupby(PARTY).sum()
     # Add votes removed by 3% rule for parties with representatives
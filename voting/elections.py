@@ -0,0 +1,188 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from constants import *
+
+DATA_DIRECTORY = './data/'
+CACHE_DIRECTORY = '.cache'
+ELECTION_FILE_PATTERN = r'spanish_congress_(\d{4})_(\d{2})\.csv$'
+PARTY_NAMES_FILE = 'spanish_congress_party_names.csv'
+
+# Parsed files of this process: path -> (signature of the source file, parsed object)
+_parsed_files = {}
+
+
+def get_file_signature(path):
+    """
+    Modification time and size of a file, used to detect changes of the source files
+    :param path: path of the file
+    :return: a tuple (float, integer)
+    """
+    stat = os.stat(path)
+    return float(stat.st_mtime), int(stat.st_size)
+
+
+def get_columnar_path(path):
+    """
+    :param path: path of a CSV file
+    :return: path of its columnar copy, in the cache directory next to the CSV file
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, CACHE_DIRECTORY, os.path.splitext(name)[0] + '.npz')
+
+
+def save_columnar(dataframe, path, signature):
+    """
+    Store a dataframe in a compact columnar format: text columns as categorical codes,
+    integer columns as int32 when their values fit and any other column with its own dtype
+    :param dataframe: dataframe
+    :param path: path of the .npz file
+    :param signature: signature of the source file, stored to check whether the copy is up to date
+    """
+    arrays = {'columns': np.array(dataframe.columns.tolist()), 'signature': np.array(signature, dtype=np.float64)}
+    for idx, column in enumerate(dataframe.columns):
+        values = dataframe[column]
+        if values.dtype == object:
+            categorical = pd.Categorical(values)
+            arrays['codes_%d' % idx] = categorical.codes.astype(np.int32)
+            arrays['categories_%d' % idx] = np.array(categorical.categories.tolist())
+        else:
+            limits = np.iinfo(np.int32)
+            fits = np.issubdtype(values.dtype, np.integer) and \
+                (values.size == 0 or limits.min <= values.min() <= values.max() <= limits.max)
+            arrays['values_%d' % idx] = values.values.astype(np.int32 if fits else values.dtype)
+            arrays['dtype_%d' % idx] = np.array(str(values.dtype))
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    np.savez(path, **arrays)
+
+
+def load_columnar(path, signature):
+    """
+    Load a dataframe stored by save_columnar if it is up to date
+    :param path: path of the .npz file
+    :param signature: current signature of the source file
+    :return: a dataframe, or None if the file does not exist or was built from another version of the source
+    """
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as arrays:
+        if tuple(arrays['signature'].tolist()) != tuple(signature):
+            return None
+        columns = arrays['columns'].tolist()
+        data = {}
+        for idx, column in enumerate(columns):
+            if 'codes_%d' % idx in arrays:
+                # Missing values have the code -1, which selects the extra last category
+                categories = np.array(arrays['categories_%d' % idx].tolist() + [np.nan], dtype=object)
+                data[column] = categories[arrays['codes_%d' % idx]]
+            else:
+                data[column] = arrays['values_%d' % idx].astype(str(arrays['dtype_%d' % idx]))
+    return pd.DataFrame(data, columns=columns)
+
+
+def read_table(path):
+    """
+    Read a CSV file through its columnar copy, which is rebuilt only when the CSV file changes
+    (the CSV file is read directly if the copy cannot be written)
+    :param path: path of the CSV file
+    :return: a dataframe equal to pd.read_csv(path)
+    """
+    signature = get_file_signature(path)
+    columnar_path = get_columnar_path(path)
+    dataframe = load_columnar(columnar_path, signature)
+    if dataframe is None:
+        dataframe = pd.read_csv(path)
+        try:
+            save_columnar(dataframe, columnar_path, signature)
+        except (IOError, OSError):
+            pass
+    return dataframe
+
+
+class ParsedElection:
+    """
+    Results of a legislative election with the aggregations used across the notebooks:
+        - dataframe: rows as in the CSV file (<REGION>, <CONSTITUENCY>, <OPTION>, <VOTES>, <SEATS>)
+        - constituencies: dictionary with constituency name as keys and number of seats as values
+        - electorate: dictionary with constituency name as keys and votes plus abstention as values
+        - total_seats: seats in parliament
+        - total_valid_votes: votes excluding abstention and invalid votes
+        - votes: dataframe indexed by <CONSTITUENCY, OPTION> with the column <VOTES>
+        - national: national totals of <VOTES> and <SEATS> of each <OPTION>, sorted by seats and votes
+    Instances are shared by every caller, so dataframes must be copied before being modified.
+    """
+    def __init__(self, dataframe):
+        self.dataframe = dataframe
+        self.constituencies = dataframe[[CONSTITUENCY, SEATS]].groupby(by=CONSTITUENCY).agg({SEATS: sum}) \
+            .to_dict()[SEATS]
+        self.electorate = dataframe.groupby(CONSTITUENCY)[VOTES].sum().to_dict()
+        self.total_seats = dataframe.groupby([REGION, CONSTITUENCY]).sum()[SEATS].sum()
+        self.total_valid_votes = dataframe[~dataframe[OPTION].isin(IGNORED_OPTION_LIST)][VOTES].sum()
+        self.votes = dataframe[[CONSTITUENCY, OPTION, VOTES]].set_index([CONSTITUENCY, OPTION])
+        national = dataframe[[OPTION, VOTES, SEATS]].groupby(OPTION).sum()
+        self.national = national.sort_values([SEATS, VOTES], ascending=False).reset_index()
+
+
+def load_file(path, parse):
+    """
+    Memoize the parsing of a file in this process, parsing it again only when it changes
+    :param path: path of the CSV file
+    :param parse: function building the parsed object from the dataframe of the file
+    :return: the parsed object
+    """
+    signature = get_file_signature(path)
+    key = (os.path.abspath(path), parse)
+    if key not in _parsed_files or _parsed_files[key][0] != signature:
+        _parsed_files[key] = (signature, parse(read_table(path)))
+    return _parsed_files[key][1]
+
+
+def load_election(year, month, directory=DATA_DIRECTORY):
+    """
+    :param year: year of the election
+    :param month: month of the election
+    :param directory: directory of the election files
+    :return: a ParsedElection instance
+    """
+    return load_election_file(os.path.join(directory, 'spanish_congress_%d_%02d.csv' % (year, month)))
+
+
+def load_election_file(path):
+    """
+    :param path: path of the election file
+    :return: a ParsedElection instance
+    """
+    return load_file(path, ParsedElection)
+
+
+def list_elections(directory=DATA_DIRECTORY):
+    """
+    :param directory: directory of the election files
+    :return: a list of tuples (election date as 'yyyy-mm', path of the election file) in the order of os.listdir
+    """
+    elections = []
+    for name in os.listdir(directory):
+        matching = re.match(ELECTION_FILE_PATTERN, name)
+        if matching:
+            elections.append(("%s-%s" % (matching.group(1), matching.group(2)), os.path.join(directory, name)))
+    return elections
+
+
+def load_party_names(year, directory=DATA_DIRECTORY):
+    """
+    :param year: year of the election
+    :param directory: directory of the election files
+    :return: a dataframe indexed by <ACRONYM> with the column <PARTY> (to be copied before being modified)
+    """
+    names = load_file(os.path.join(directory, PARTY_NAMES_FILE), _index_party_names)
+    return names[year] if year in names else pd.DataFrame(columns=[PARTY], index=pd.Index([], name=ACRONYM))
+
+
+def _index_party_names(dataframe):
+    """
+    :param dataframe: party names file
+    :return: a dictionary with years as keys and dataframes indexed by <ACRONYM> with the column <PARTY> as values
+    """
+    return dict((year, names[[ACRONYM, PARTY]].set_index(ACRONYM)) for year, names in dataframe.groupby(YEAR))
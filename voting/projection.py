@@ -0,0 +1,170 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+from apportionment import allocate_seats_in_batch, build_vote_matrix
+from constants import *
+
+
+def sample_vote_scenarios(votes, scenarios, random_state, noise='dirichlet', concentration=1000.0):
+    """
+    Draw perturbed vote vectors around the results of a constituency
+    :param votes: numpy array with the votes of each option
+    :param scenarios: number of vote vectors to be drawn
+    :param random_state: numpy RandomState
+    :param noise: 'dirichlet' to draw the vote shares from a Dirichlet distribution centered on the results,
+                  'multinomial' to draw the same total of votes with the shares of the results
+    :param concentration: sum of the Dirichlet parameters, the larger the smaller the noise
+                          (the standard deviation of a share p is sqrt(p * (1 - p) / (concentration + 1)))
+    :return: a [scenarios]x[options] numpy array of votes
+    """
+    total = float(votes.sum())
+    shares = votes / total
+    if noise == 'dirichlet':
+        # Options without votes have a null parameter and keep no votes
+        gammas = random_state.standard_gamma(concentration * shares, size=(scenarios, len(votes)))
+        return total * gammas / gammas.sum(axis=1)[:, np.newaxis]
+    elif noise == 'multinomial':
+        return random_state.multinomial(int(total), shares, size=scenarios)
+    else:
+        raise ValueError("noise parameter must be one of the following values: dirichlet, multinomial")
+
+
+def _project_block(block):
+    """
+    Draw and apportion a block of scenarios.
+    :param block: tuple (seed, block index, number of scenarios, constituency data, number of parties,
+                  maximum seats in a constituency, noise, concentration, formula, minimum percentage)
+    :return: a tuple ([scenarios]x[parties] numpy array of seats, [constituencies]x[parties]x[maximum seats + 1]
+             numpy array counting the scenarios with each number of seats)
+    """
+    seed, block_idx, size, constituencies, number_of_parties, max_seats, noise, concentration, formula, \
+        minimum_percentage = block
+    random_state = np.random.RandomState([seed, block_idx])
+    national_seats = np.zeros((size, number_of_parties), dtype=int)
+    counts = np.zeros((len(constituencies), number_of_parties, max_seats + 1), dtype=np.int64)
+    for constituency_idx, (votes, options, party_indexes, seats) in enumerate(constituencies):
+        scenario_votes = sample_vote_scenarios(votes, size, random_state, noise, concentration)
+        scenario_seats = allocate_seats_in_batch(scenario_votes, seats, options, formula, minimum_percentage)
+        party_seats = np.zeros((size, number_of_parties), dtype=int)
+        for column, party_idx in enumerate(party_indexes):
+            if party_idx > -1:
+                party_seats[:, party_idx] += scenario_seats[:, column]
+        national_seats += party_seats
+        codes = np.arange(number_of_parties) * (max_seats + 1) + party_seats
+        counts[constituency_idx] += np.bincount(codes.ravel(), minlength=counts[constituency_idx].size) \
+            .reshape((number_of_parties, max_seats + 1))
+    return national_seats, counts
+
+
+class SeatProjection:
+    """
+    Seats of each party in a set of simulated vote scenarios:
+        - seats: [scenarios]x[parties] numpy array with the seats in parliament of each scenario
+        - baseline: seats of each party with the unperturbed votes
+        - constituency_counts: [constituencies]x[parties]x[seats + 1] numpy array counting the scenarios
+                               in which each party gets each number of seats in each constituency
+        - constituency_baseline: [constituencies]x[parties] numpy array with the unperturbed seats
+    """
+    def __init__(self, parties, constituencies, seats, baseline, constituency_counts, constituency_baseline):
+        self.parties = parties
+        self.constituencies = constituencies
+        self.seats = seats
+        self.baseline = baseline
+        self.constituency_counts = constituency_counts
+        self.constituency_baseline = constituency_baseline
+        self.majority = int(baseline.sum()) // 2 + 1
+
+    def majority_probability(self, parties):
+        """
+        :param parties: a party or a list of parties (coalition)
+        :return: the probability of getting at least the absolute majority of the parliament
+        """
+        parties = parties if isinstance(parties, (list, tuple)) else [parties]
+        columns = [self.parties.index(party) for party in parties]
+        return float((self.seats[:, columns].sum(axis=1) >= self.majority).mean())
+
+    def summary(self, quantiles=(0.05, 0.5, 0.95)):
+        """
+        Seat distribution of each party.
+        :param quantiles: quantiles of the seats to be reported
+        :return: a dataframe indexed by <PARTY> with the baseline seats, mean and standard deviation of the seats,
+                 the quantiles and the probability of absolute majority, sorted by baseline and mean seats
+        """
+        df = pd.DataFrame({'baseline': self.baseline, 'mean': self.seats.mean(axis=0),
+                           'std': self.seats.std(axis=0)}, index=pd.Index(self.parties, name=PARTY),
+                          columns=['baseline', 'mean', 'std'])
+        for quantile in quantiles:
+            df['q%g' % (100 * quantile)] = np.percentile(self.seats, 100 * quantile, axis=0)
+        df['majority'] = (self.seats >= self.majority).mean(axis=0)
+        return df.sort_values(['baseline', 'mean'], ascending=False)
+
+    def constituency_seat_probabilities(self):
+        """
+        :return: a [constituencies]x[parties]x[seats + 1] numpy array with the probability of each party
+                 getting each number of seats in each constituency
+        """
+        return self.constituency_counts / float(self.seats.shape[0])
+
+    def marginal_seat_probabilities(self):
+        """
+        Probability of each party getting a number of seats different from the baseline in each constituency,
+        i.e. of winning or losing a marginal seat.
+        :return: a dataframe with constituencies as index and parties as columns
+        """
+        constituencies, parties = np.indices(self.constituency_baseline.shape)
+        unchanged = self.constituency_counts[constituencies, parties, self.constituency_baseline]
+        return pd.DataFrame(1 - unchanged / float(self.seats.shape[0]),
+                            index=pd.Index(self.constituencies, name=CONSTITUENCY), columns=self.parties)
+
+
+def simulate_seat_projections(dataframe, scenarios, formula="d'Hondt", minimum_percentage=3.0, noise='dirichlet',
+                              concentration=1000.0, seed=None, processes=None, block_size=1000):
+    """
+    Draw vote scenarios around the results of each constituency and apportion all of them in batches.
+    Scenarios are split into blocks of block_size scenarios and each block gets its own random state
+    spawned from seed, so the result for a fixed seed is the same whatever the number of processes.
+    :param dataframe: constituency results with columns <CONSTITUENCY>, <OPTION>, <VOTES> and <SEATS>
+                      (as in legislative_election_2019_04.csv)
+    :param scenarios: number of vote scenarios
+    :param formula: apportionment rule.
+                    Valid values: d'Hondt, Sainte-Lague, Modified Sainte-Lague, Danish, Imperiali
+    :param minimum_percentage: float as a percentage non as a ratio. Default value according to the Spanish law
+    :param noise: 'dirichlet' or 'multinomial' (see sample_vote_scenarios)
+    :param concentration: sum of the Dirichlet parameters, the larger the smaller the noise
+    :param seed: root seed from which the random states of the blocks are spawned (random if None)
+    :param processes: number of worker processes (number of CPUs if None, no pool if 1)
+    :param block_size: number of scenarios drawn with the same random state
+    :return: a SeatProjection instance
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    seats_by_constituency = dataframe.groupby(CONSTITUENCY)[SEATS].sum().to_dict()
+    names, options, votes, seats = build_vote_matrix(dataframe.set_index([CONSTITUENCY, OPTION])[[VOTES]],
+                                                     seats_by_constituency)
+    baseline_seats = allocate_seats_in_batch(votes, seats, options, formula, minimum_percentage)
+    parties = sorted(set([option for option in options
+                          if option not in IGNORED_OPTION_LIST and option != OPTION_BLANK_VOTE]))
+    party_indexes = np.array([parties.index(option) if option in parties else -1 for option in options])
+    constituency_baseline = np.zeros((len(names), len(parties)), dtype=int)
+    constituencies = []
+    for constituency_idx in range(len(names)):
+        columns = np.flatnonzero(votes[constituency_idx] > 0)
+        for column in columns[party_indexes[columns] > -1]:
+            constituency_baseline[constituency_idx, party_indexes[column]] += baseline_seats[constituency_idx, column]
+        constituencies.append((votes[constituency_idx, columns].astype(np.float64), [options[c] for c in columns],
+                               [int(party_indexes[c]) for c in columns], int(seats[constituency_idx])))
+    starts = list(range(0, scenarios, block_size))
+    blocks = [(seed, block_idx, min(block_size, scenarios - start), constituencies, len(parties), int(seats.max()),
+               noise, concentration, formula, minimum_percentage) for block_idx, start in enumerate(starts)]
+    if processes == 1:
+        results = [_project_block(block) for block in blocks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_project_block, blocks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return SeatProjection(parties, names, np.concatenate([national_seats for national_seats, _ in results]),
+                          constituency_baseline.sum(axis=0), sum([counts for _, counts in results]),
+                          constituency_baseline)
@@ -1,12 +1,12 @@
 import pandas as pd
 import numpy as np
-import os
-import re
+import multiprocessing
 from constants import *
 from disproportionality import calculate_disproportionality_indexes
 from disproportionality import calculate_votes_and_seats_percentages
 from disproportionality import calculate_effective_number_of_parties
 from apportionment import calculate_parliament, assign_constituency_representatives, get_allowed_formulas
+from elections import list_elections, load_election, load_election_file, load_party_names
 
 
 def convert_dict_to_df(dictionary, names=(DATE, SINGLE_CONSTITUENCY)):
@@ -41,18 +41,11 @@ def calculate_dispr_indexes_and_parties():
     seats = {}
     eff_n_parties = {}
 
-    directory = "./data/"
-    elections = [f for f in os.listdir(directory) if re.match(r'spanish_congress_\d{4}_\d{2}', f)]
+    for election_date, path in list_elections():
+        election = load_election_file(path)
+        total_seats_in_parliament = election.total_seats
 
-    for election in elections:
-        matching = re.match(r'spanish_congress_(\d{4})_(\d{2})', election)
-        election_date = "%s-%s" % (matching.group(1), matching.group(2))
-
-        df = pd.read_csv('./data/%s' % election)
-        total_seats_in_parliament = df.groupby([REGION, CONSTITUENCY]).sum()[SEATS].sum()
-
-        spain_df = df[[OPTION, VOTES, SEATS]].groupby(OPTION).sum()
-        spain_df = spain_df.sort_values([SEATS, VOTES], ascending=False).reset_index()
+        spain_df = election.national.copy()
         df_total_votes = spain_df.set_index(OPTION)
         parliament = spain_df[spain_df[SEATS] > 0]
         parliament = parliament.set_index(OPTION)
@@ -93,20 +86,14 @@ def calculate_disproportionality_indexes_by_formula():
              following columns: rae, loosemore_hanby, gallagher, grofman, lijphart, saint_lague, dhondt, cox_shugart.
     """
     dispr = {}
-    directory = "./data/"
-    elections = [f for f in os.listdir(directory) if re.match(r'spanish_congress_\d{4}_\d{2}', f)]
     formulas = get_allowed_formulas()
-    for election in elections:
-        matching = re.match(r'spanish_congress_(\d{4})_(\d{2})', election)
-        election_date = "%s-%s" % (matching.group(1), matching.group(2))
+    for election_date, path in list_elections():
+        election = load_election_file(path)
+        constituencies = election.constituencies
+        total_seats_in_parliament = election.total_seats
+        dataframe = election.votes
 
-        df = pd.read_csv('./data/%s' % election)
-        constituencies = df[[CONSTITUENCY, SEATS]].groupby(by=CONSTITUENCY).agg({SEATS: sum}).to_dict()[SEATS]
-        total_seats_in_parliament = df.groupby([REGION, CONSTITUENCY]).sum()[SEATS].sum()
-        dataframe = df[[CONSTITUENCY, OPTION, VOTES]].set_index([CONSTITUENCY, OPTION])
-
-        spain_df = df[[OPTION, VOTES, SEATS]].groupby(OPTION).sum()
-        spain_df = spain_df.sort_values([SEATS, VOTES], ascending=False).reset_index()
+        spain_df = election.national.copy()
         df_total_votes = spain_df.set_index(OPTION)
 
         # Actual parliament config
@@ -130,6 +117,109 @@ def calculate_disproportionality_indexes_by_formula():
     return dispr_df
 
 
+def scale_constituency_seats(constituencies, electorate, total_seats, minimum_seats=2):
+    """
+    Distribute a new total of seats among the constituencies as the Spanish law does: a minimum of seats for each
+    constituency (the current seats if lower, as in Ceuta and Melilla) and the rest proportionally to the
+    electorate by largest remainders
+    :param constituencies: dictionary with constituency name as keys and number of seats as values
+    :param electorate: dictionary with constituency name as keys and electorate (votes and abstention) as values
+    :param total_seats: total seats in parliament
+    :param minimum_seats: minimum seats of each constituency
+    :return: a dictionary with constituency name as keys and number of seats as values
+    """
+    names = sorted(constituencies.keys())
+    seats = np.array([min(constituencies[name], minimum_seats) for name in names])
+    if total_seats < seats.sum():
+        raise ValueError("At least %d seats are required, got %d" % (seats.sum(), total_seats))
+    weights = np.array([electorate[name] for name in names], dtype=float)
+    quotas = (total_seats - seats.sum()) * weights / weights.sum()
+    seats += np.floor(quotas).astype(int)
+    remainders = np.argsort(-(quotas - np.floor(quotas)), kind='mergesort')
+    seats[remainders[:total_seats - seats.sum()]] += 1
+    return dict(zip(names, [int(n) for n in seats]))
+
+
+def _calculate_election_disproportionality(task):
+    """
+    Calculate the disproportionality indexes of an election for every formula and threshold of a sweep.
+    :param task: tuple (path of the election file, election date, formulas, thresholds, total seats or None,
+                 add the total seats to the keys)
+    :return: a dictionary with keys (election date, formula[, threshold][, total seats]) and dictionaries
+             of disproportionality indexes as values
+    """
+    path, election_date, formulas, thresholds, total_seats, seats_in_key = task
+    election = load_election_file(path)
+    constituencies = election.constituencies
+    if total_seats is not None:
+        constituencies = scale_constituency_seats(constituencies, election.electorate, total_seats)
+    total_seats_in_parliament = sum(constituencies.values())
+    dataframe = election.votes
+    spain_df = election.national.copy()
+    df_total_votes = spain_df.set_index(OPTION)
+
+    def get_key(formula, threshold):
+        return (election_date, formula) + (() if thresholds is None else (threshold,)) + \
+            ((total_seats_in_parliament,) if seats_in_key else ())
+
+    dispr = {}
+    for threshold in [3.0] if thresholds is None else thresholds:
+        for formula in formulas:
+            parliament = calculate_parliament(dataframe, constituencies, formula=formula, minimum_percentage=threshold,
+                                              verbose=False, vectorized=True)
+            dispr[get_key(formula, threshold)] = calculate_disproportionality_indexes(parliament, df_total_votes,
+                                                                                      verbose=False)
+    # Single constituency parliament config
+    parliament_single_cons = assign_constituency_representatives(spain_df,
+                                                                 total_seats_in_parliament,
+                                                                 formula="d'Hondt",
+                                                                 minimum_percentage=0.0)
+    d = calculate_disproportionality_indexes(parliament_single_cons, df_total_votes, verbose=False)
+    for threshold in [None] if thresholds is None else thresholds:
+        dispr[get_key('Single Constituency', threshold)] = d
+    return dispr
+
+
+def sweep_disproportionality_indexes(elections=None, formulas=None, thresholds=None, seat_totals=None,
+                                     processes=None, directory="./data/"):
+    """
+    Estimate the disproportionality indexes of the legislative elections in Spain over a grid of electoral formulas,
+    thresholds and totals of seats, fanning the elections and totals of seats out over a pool of processes.
+    The case for a single constituency with no electoral threshold is also calculated.
+    :param elections: list of election dates as strings 'yyyy-mm' (every election from 1977 if None)
+    :param formulas: list of electoral formulas (those returned by <pre>get_allowed_formulas</pre> if None)
+    :param thresholds: list of minimum percentages to enter in the apportionment (3% if None)
+    :param seat_totals: list of totals of seats in parliament, distributed among the constituencies by
+                        <pre>scale_constituency_seats</pre> (the actual seats if None)
+    :param processes: number of worker processes (number of CPUs if None, no pool if 1)
+    :param directory: directory of the election files
+    :return: a dataframe as returned by <pre>calculate_disproportionality_indexes_by_formula</pre>, with also
+             the columns 'Threshold' if thresholds are given and 'Total_seats' if seat_totals are given
+    """
+    files = [(date, path) for date, path in sorted(list_elections(directory)) if elections is None or date in elections]
+    formulas = get_allowed_formulas() if formulas is None else formulas
+    tasks = [(path, date, formulas, thresholds, total_seats, seat_totals is not None)
+             for date, path in files for total_seats in ([None] if seat_totals is None else seat_totals)]
+    if processes == 1:
+        results = [_calculate_election_disproportionality(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_calculate_election_disproportionality, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    dispr = {}
+    for result in results:
+        dispr.update(result)
+    names = (DATE, 'Formula') + (() if thresholds is None else ('Threshold',)) + \
+        (() if seat_totals is None else ('Total_seats',))
+    dispr_df = convert_dict_to_df(dispr, names=names)
+    # Columns of dictionaries merged from several processes come in arbitrary order
+    return dispr_df[list(names[1:]) + ['rae', 'loosemore_hanby', 'gallagher', 'grofman',
+                                       'lijphart', 'saint_lague', 'dhondt', 'cox_shugart']]
+
+
 def get_parliaments_by_election(year, month, threshold=0.0):
     """
     Return the parliament compositions calculated using the current law and the d'Hondt formula for a single
@@ -139,18 +229,15 @@ def get_parliaments_by_election(year, month, threshold=0.0):
     :param threshold: minimum percentage to enter in the apportionment
     :return: A 2-tuple of dataframes containing party, votes (number and percentage) and seats (number and percentage)
     """
-    names = pd.read_csv('./data/spanish_congress_party_names.csv')
-    names = names[names[YEAR] == year][[ACRONYM, PARTY]]
-    names.set_index(ACRONYM, inplace=True)
+    names = load_party_names(year)
     columns = [VOTES, VOTES_PERCENTAGE, SEATS, SEATS_PERCENTAGE]
 
-    df = pd.read_csv('./data/spanish_congress_%d_%02d.csv' % (year, month))
-    total_seats_in_parliament = df.groupby([REGION, CONSTITUENCY]).sum()[SEATS].sum()
-    total_valid_votes = df[~df[OPTION].isin(IGNORED_OPTION_LIST)][VOTES].sum()
+    election = load_election(year, month)
+    total_seats_in_parliament = election.total_seats
+    total_valid_votes = election.total_valid_votes
 
     # Actual parliament config
-    spain_df = df[[OPTION, VOTES, SEATS]].groupby(OPTION).sum()
-    spain_df = spain_df.sort_values([SEATS, VOTES], ascending=False).reset_index()
+    spain_df = election.national.copy()
     parliament = spain_df[spain_df[SEATS] > 0]
     parliament = parliament.set_index(OPTION)
     parliament[VOTES + '_%'] = np.round(100.0 * parliament[VOTES] / total_valid_votes, 2)
@@ -182,21 +269,18 @@ def get_parliaments_by_election_and_formula(year, month, formulas, threshold=3.0
     :param threshold: minimum percentage to enter in the apportionment
     :return: a n-tuple of dataframes containing party, votes (number and percentage) and seats (number and percentage)
     """
-    names = pd.read_csv('./data/spanish_congress_party_names.csv')
-    names = names[names[YEAR] == year][[ACRONYM, PARTY]]
-    names.set_index(ACRONYM, inplace=True)
+    names = load_party_names(year)
     columns = [VOTES, VOTES_PERCENTAGE, SEATS, SEATS_PERCENTAGE]
 
-    df = pd.read_csv('./data/spanish_congress_%d_%02d.csv' % (year, month))
-    constituencies = df[[CONSTITUENCY, SEATS]].groupby(by=CONSTITUENCY).agg({SEATS: sum}).to_dict()[SEATS]
-    total_seats_in_parliament = df.groupby([REGION, CONSTITUENCY]).sum()[SEATS].sum()
-    total_valid_votes = df[~df[OPTION].isin(IGNORED_OPTION_LIST)][VOTES].sum()
+    election = load_election(year, month)
+    constituencies = election.constituencies
+    total_seats_in_parliament = election.total_seats
+    total_valid_votes = election.total_valid_votes
 
     parliaments = []
 
     # Actual parliament config
-    spain_df = df[[OPTION, VOTES, SEATS]].groupby(OPTION).sum()
-    spain_df = spain_df.sort_values([SEATS, VOTES], ascending=False).reset_index()
+    spain_df = election.national.copy()
     parliament = spain_df[spain_df[SEATS] > 0]
     parliament = parliament.set_index(OPTION)
     parliament[VOTES + '_%'] = np.round(100.0 * parliament[VOTES] / total_valid_votes, 2)
@@ -206,7 +290,7 @@ def get_parliaments_by_election_and_formula(year, month, formulas, threshold=3.0
     parliaments.append(parliament[columns])
 
     # formulas
-    dataframe = df[[CONSTITUENCY, OPTION, VOTES]].set_index([CONSTITUENCY, OPTION])
+    dataframe = election.votes
     for formula in formulas:
         apportionment = calculate_parliament(dataframe, constituencies, formula=formula,
                                              minimum_percentage=threshold, verbose=False)